@@ -12,4 +12,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ApiRoot.settings')
 
-application = get_asgi_application()
+# Initialize Django before importing anything that touches models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from chat.auth import JwtAuthMiddleware
+from chat.routing import websocket_urlpatterns
+from chat.writer import lifespan
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': JwtAuthMiddleware(
+        URLRouter(websocket_urlpatterns)
+    ),
+    'lifespan': lifespan,
+})
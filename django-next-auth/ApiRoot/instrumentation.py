@@ -0,0 +1,221 @@
+import bisect
+import hmac
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Per-request (or per-WebSocket-event) timings. The metrics object lives in
+# a contextvar, so queries run through sync_to_async/database_sync_to_async
+# are counted against the request or event that made them.
+
+SLOW_QUERY_MS = getattr(settings, 'SLOW_QUERY_MS', None)
+SERVER_TIMING = getattr(settings, 'INSTRUMENTATION_SERVER_TIMING', True)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_current = ContextVar('instrumentation_metrics', default=None)
+
+# Every Counter and Histogram, in the order they are exposed
+REGISTRY = []
+
+
+class Metrics:
+    __slots__ = ('queries', 'db_time', 'serialize_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for label_values, counts, total in series:
+            pairs = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{label_set(pairs + [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{label_set(pairs)} {total}')
+            lines.append(f'{self.name}_count{label_set(pairs)} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f'{self.name}{label_set(zip(self.labels, label_values))} {value}')
+        return lines
+
+
+def label_set(pairs):
+    # '{a="1",b="2"}', or nothing at all for an unlabeled series
+    labels = ','.join(f'{key}="{escape(value)}"' for key, value in pairs)
+    return f'{{{labels}}}' if labels else ''
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+http_requests = Counter('http_requests_total', 'HTTP requests', ('view', 'method', 'status'))
+http_duration = Histogram('http_request_duration_seconds', 'Wall time per HTTP request', ('view',), DURATION_BUCKETS)
+http_db_queries = Histogram('http_db_queries', 'Database queries per HTTP request', ('view',), QUERY_BUCKETS)
+http_db_duration = Histogram('http_db_duration_seconds', 'Database time per HTTP request', ('view',), DURATION_BUCKETS)
+http_serialize_duration = Histogram(
+    'http_serialize_duration_seconds', 'Response rendering time per HTTP request', ('view',), DURATION_BUCKETS
+)
+http_response_size = Histogram('http_response_size_bytes', 'HTTP response body size', ('view',), SIZE_BUCKETS)
+ws_duration = Histogram('ws_event_duration_seconds', 'Wall time per consumer event', ('consumer', 'event'), DURATION_BUCKETS)
+ws_db_queries = Histogram('ws_db_queries', 'Database queries per consumer event', ('consumer', 'event'), QUERY_BUCKETS)
+slow_queries = Counter('db_slow_queries_total', 'Queries slower than SLOW_QUERY_MS', ())
+
+
+def record_query(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db_time += elapsed
+        if SLOW_QUERY_MS is not None and elapsed * 1000 >= SLOW_QUERY_MS:
+            slow_queries.inc()
+            logger.warning('Slow query (%.1f ms): %s', elapsed * 1000, sql)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+# Connections opened before this module was first imported
+for connection in connections.all(initialized_only=True):
+    install_query_recorder(None, connection)
+
+
+@contextmanager
+def timed_serialization():
+    metrics = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.serialize_time += time.perf_counter() - start
+
+
+class InstrumentationMiddleware:
+    """
+    Records wall time, database queries and time, rendering time and
+    response size per view, and reports them to the client in a
+    Server-Timing header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = Metrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.url_name or match.route) if match else 'unmatched'
+        http_requests.inc(view, request.method, response.status_code)
+        http_duration.observe(elapsed, view)
+        http_db_queries.observe(metrics.queries, view)
+        http_db_duration.observe(metrics.db_time, view)
+        http_serialize_duration.observe(metrics.serialize_time, view)
+        if not response.streaming:
+            http_response_size.observe(len(response.content), view)
+
+        if SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries", '
+                f'serialize;dur={metrics.serialize_time * 1000:.1f}, '
+                f'total;dur={elapsed * 1000:.1f}'
+            )
+        return response
+
+
+class InstrumentedConsumerMixin:
+    # Records wall time and database queries per event handled by a consumer
+
+    async def dispatch(self, message):
+        metrics = Metrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            _current.reset(token)
+            event = message['type']
+            ws_duration.observe(time.perf_counter() - start, type(self).__name__, event)
+            ws_db_queries.observe(metrics.queries, type(self).__name__, event)
+
+
+def metrics_view(request):
+    # Prometheus text format. Metrics are per process, so scrape each worker.
+    # Disabled unless METRICS_TOKEN is set; scrapers send it as a bearer token
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        raise Http404
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def use_replica():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads(func):
+    # Route the reads a view method makes to the replica, if there is one
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Sends reads made inside use_replica() to the 'replica' alias when one is
+    configured. Everything else goes to the primary, including reads inside
+    a transaction on it, so a request's own writes stay visible to it.
+    Routing is explicit both ways: objects loaded from the replica are
+    still saved to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            _replica_reads.get()
+            and REPLICA_DB_ALIAS in settings.DATABASES
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema through replication
+        return db != REPLICA_DB_ALIAS
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -33,6 +36,7 @@ ALLOWED_HOSTS = [
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -45,10 +49,13 @@ INSTALLED_APPS = [
     'djoser',
     'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
+    'channels',
     'users',
+    'chat',
 ]
 
 MIDDLEWARE = [
+    'ApiRoot.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,17 +87,116 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'ApiRoot.wsgi.application'
 
+ASGI_APPLICATION = 'ApiRoot.asgi.application'
+
+
+# Cache and channel layer
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# https://channels.readthedocs.io/en/latest/topics/channel_layers.html
+# In-memory for development and tests (single process only); set REDIS_URL to
+# share cached state and groups across workers
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# SQLite by default. DB_ENGINE=postgres with DB_NAME/DB_USER/DB_PASSWORD/
+# DB_HOST/DB_PORT for production, using persistent connections or, with
+# DB_POOL=1, psycopg's connection pool. DB_REPLICA_HOST (or DB_REPLICA_NAME)
+# adds a 'replica' alias that read-only views are routed to.
+# SQLITE_TUNING=1 is the single-node SQLite profile: WAL so readers don't
+# block on the chat writes, and writers that take the lock up front and
+# wait for it instead of failing with "database is locked".
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+SQLITE_TUNING = os.environ.get('SQLITE_TUNING', '') == '1'
+SQLITE_TUNING_OPTIONS = {
+    # Run on every new connection
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA busy_timeout=5000;'
+        'PRAGMA mmap_size=268435456;'
+        'PRAGMA cache_size=-65536;'
+    ),
+    'transaction_mode': 'IMMEDIATE',
+}
+
+
+def database_config(host=None, name=None):
+    if DB_ENGINE == 'postgres':
+        config = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': name or os.environ.get('DB_NAME', 'tutorconnect'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': host or os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_HEALTH_CHECKS': True,
+        }
+        if os.environ.get('DB_POOL') == '1':
+            # The pool owns connection reuse; persistent connections must be off
+            config['CONN_MAX_AGE'] = 0
+            config['OPTIONS'] = {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                },
+            }
+        else:
+            config['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+        return config
+    return {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': name or os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': dict(SQLITE_TUNING_OPTIONS) if SQLITE_TUNING else {},
     }
+
+
+DATABASES = {
+    'default': database_config(),
 }
 
+if os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = database_config(
+        host=os.environ.get('DB_REPLICA_HOST'),
+        name=os.environ.get('DB_REPLICA_NAME'),
+    )
+    # Tests run against the primary only
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['ApiRoot.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -128,6 +234,16 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (profile pictures)
+# Names are content hashes, so these URLs can be cached indefinitely
+
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+PROFILE_THUMBNAIL_SIZE = (256, 256)
+PROFILE_THUMBNAIL_FORMAT = 'WEBP'
+IMAGE_PROCESSING_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -135,12 +251,109 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'auth.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'users.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
+# Process-local cache of authenticated users and their profiles
+USER_CACHE_TTL = 30
+USER_CACHE_MAX_SIZE = 1024
+
+# Mutual-match status per user pair, checked on every chat connect
+MUTUAL_MATCH_CACHE_TTL = 300
+
+# Request instrumentation: Server-Timing headers, Prometheus metrics at
+# /internal/metrics/ (only with METRICS_TOKEN set) and, with SLOW_QUERY_MS
+# set, a warning logged for every query slower than that
+INSTRUMENTATION_SERVER_TIMING = True
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+SLOW_QUERY_MS = int(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+
+# Per-user response version counters behind the ETags on profile/match views
+RESPONSE_VERSION_TTL = 60 * 60 * 24
+
+# Potential-match pages: fresh for TTL, then served stale (up to STALE_TTL)
+# while a background worker rebuilds them
+POTENTIAL_MATCHES_CACHE_TTL = 300
+POTENTIAL_MATCHES_STALE_TTL = 60 * 60
+POTENTIAL_MATCHES_REFRESH_WORKERS = 2
+
+# Chat messages
+# Write-behind mode (CHAT_WRITE_BEHIND=1) broadcasts messages immediately and
+# persists them in batches, turning a write per message into one transaction
+# per batch. Off unless asked for, whatever the database profile: a message
+# is acknowledged before it is stored, and a crashed worker loses the queue
+# (see chat.writer.MessageWriter)
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', '') == '1'
+CHAT_WRITE_BEHIND_INTERVAL_MS = 50
+CHAT_WRITE_BEHIND_BATCH_SIZE = 100
+
+# Chat socket limits: frames larger than this close the socket, frames over
+# either token bucket (messages per second, burst) are dropped, and a socket
+# with this many outgoing frames waiting is disconnected as too slow. Per-user
+# buckets are per process. CHAT_RATE_LIMITS = None turns rate limiting off
+CHAT_MAX_MESSAGE_BYTES = 16 * 1024
+CHAT_RATE_LIMITS = {
+    'connection': (5, 20),
+    'user': (10, 40),
+}
+CHAT_SEND_QUEUE_SIZE = 256
+
+# A sync frame from a reconnecting client gets up to CHAT_SYNC_LIMIT missed
+# messages, CHAT_BATCH_SIZE to a frame
+CHAT_SYNC_LIMIT = 500
+CHAT_BATCH_SIZE = 100
+
+# Message ids are handed out before their rows commit: at once in
+# write-behind mode, and before waiting for the write lock otherwise. Syncs
+# and after_id polls therefore also resend the messages from the
+# CHAT_SYNC_OVERLAP_MS before the client's last id, which must be longer
+# than a write-behind flush with its retries or a write waiting out
+# SQLite's busy_timeout
+CHAT_SYNC_OVERLAP_MS = 10 * 1000
+
+# A user is online while a chat socket of theirs has sent a heartbeat within
+# PRESENCE_TTL seconds; typing events to one partner go out at most once per
+# TYPING_INTERVAL seconds
+PRESENCE_TTL = 60
+TYPING_INTERVAL = 1.0
+
+# Worker id (0-15) embedded in message ids; must differ between the
+# processes writing messages, or they could repeat primary keys. Required
+# with Postgres or REDIS_URL, where those processes can be on several hosts.
+# On SQLite they are all on this one, and each process left without an id
+# claims a free one through a lock on MESSAGE_ID_LOCK_FILE
+MESSAGE_ID_WORKER = os.environ.get('MESSAGE_ID_WORKER')
+if MESSAGE_ID_WORKER is None and (REDIS_URL or DB_ENGINE != 'sqlite'):
+    raise ImproperlyConfigured(
+        'Set MESSAGE_ID_WORKER (0-15, different for every process) with Postgres or when REDIS_URL is set'
+    )
+MESSAGE_ID_LOCK_FILE = os.environ.get('MESSAGE_ID_LOCK_FILE', f"{DATABASES['default']['NAME']}.message-ids")
+
+# Chat logs go through a queue to a background thread as JSON lines, so the
+# consumers never block the event loop on log I/O
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {'()': 'chat.log.StructuredFormatter'},
+    },
+    'handlers': {
+        'chat': {'class': 'chat.log.BackgroundHandler', 'formatter': 'structured'},
+    },
+    'loggers': {
+        'chat': {'handlers': ['chat'], 'level': os.environ.get('CHAT_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
 SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
+    # last_login feeds the activity component of potential-match ranking
+    "UPDATE_LAST_LOGIN": True,
 }
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
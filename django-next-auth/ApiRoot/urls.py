@@ -14,10 +14,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from auth.views import LogoutView
-from users.views import OnboardingView, ProfileView, PotentialMatchesView, MatchActionView, MatchesListView, MatchRequestsView, ChatHistoryView, MessageView
+from ApiRoot.instrumentation import metrics_view
+from users.views import OnboardingView, ProfileView, PotentialMatchesView, MatchActionView, MatchesListView, MatchRequestsView, ChatHistoryView, ConversationListView, MessageSearchView, MessageView, UserCacheStatsView
 
 urlpatterns = [
     path("auth/", include("djoser.urls")),
@@ -30,5 +33,12 @@ urlpatterns = [
     path('matches/<int:user_id>/', MatchActionView.as_view(), name='match-action'),
     path('match-requests/', MatchRequestsView.as_view(), name='match-requests'),
     path('chat-history/<int:user_id>/', ChatHistoryView.as_view(), name='chat-history'),
+    path('conversations/', ConversationListView.as_view(), name='conversations'),
+    path('search/messages/', MessageSearchView.as_view(), name='search-messages'),
     path('messages/<int:user_id>/', MessageView.as_view(), name='send-message'),
+    path('internal/user-cache/', UserCacheStatsView.as_view(), name='user-cache-stats'),
+    path('internal/metrics/', metrics_view, name='metrics'),
 ]
+
+# Serve uploaded media in development only
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -2,16 +2,23 @@ from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.tokens import AccessToken
-from django.contrib.auth import get_user_model
+from users.cache import user_cache
 
 @database_sync_to_async
-def get_user(token_key):
+def load_user(user_id):
+    return user_cache.get(user_id)
+
+async def get_user(token_key):
     try:
         access_token = AccessToken(token_key)
-        user = get_user_model().objects.get(id=access_token['user_id'])
-        return user
+        user_id = access_token['user_id']
+        # Cache hits don't need a trip to the database thread
+        user = user_cache.peek(user_id) or await load_user(user_id)
     except Exception as e:
         return AnonymousUser()
+    if user is None or not user.is_active:
+        return AnonymousUser()
+    return user
 
 class JwtAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
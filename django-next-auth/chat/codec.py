@@ -0,0 +1,88 @@
+import json
+from datetime import datetime, timezone
+
+import msgpack
+
+# Chat frame encodings. Consumers work with JSON-shaped dicts; a codec turns
+# them into text or binary WebSocket frames and back. Clients choose one by
+# WebSocket subprotocol and get JSON text frames when they ask for none.
+
+
+class JSONCodec:
+    subprotocol = 'chat.json.v1'
+
+    def decode(self, text_data, bytes_data):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+    def encode(self, frame):
+        # (text_data, bytes_data) for AsyncWebsocketConsumer.send
+        return json.dumps(frame), None
+
+
+class MsgpackCodec:
+    """
+    Binary frames: a msgpack map keyed by small integer tags, with frame
+    types as integers and timestamps as integer microseconds since the
+    epoch. Tags are append-only; never renumber one that has shipped.
+    """
+
+    subprotocol = 'chat.msgpack.v1'
+
+    FIELDS = (
+        'type', 'conversation', 'id', 'content', 'sender_id', 'receiver_id', 'timestamp', 'is_read',
+        'reader_id', 'last_read_id', 'user_id', 'online', 'event', 'error', 'message', 'messages', 'after_id',
+    )
+    TYPES = ('message', 'read', 'typing', 'presence', 'match', 'heartbeat', 'batch', 'sync')
+
+    FIELD_TAGS = {name: tag for tag, name in enumerate(FIELDS)}
+    TYPE_TAGS = {name: tag for tag, name in enumerate(TYPES)}
+
+    def decode(self, text_data, bytes_data):
+        if bytes_data is None:
+            raise ValueError('Expected a binary frame')
+        packed = msgpack.unpackb(bytes_data, strict_map_key=False)
+        if not isinstance(packed, dict):
+            raise ValueError('Expected a map')
+        frame = {self.FIELDS[tag]: value for tag, value in packed.items() if isinstance(tag, int) and tag < len(self.FIELDS)}
+        if isinstance(frame.get('type'), int) and frame['type'] < len(self.TYPES):
+            frame['type'] = self.TYPES[frame['type']]
+        return frame
+
+    def encode(self, frame):
+        return None, msgpack.packb(self.pack(frame))
+
+    def pack(self, frame):
+        packed = {}
+        for name, value in frame.items():
+            if name == 'type':
+                value = self.TYPE_TAGS[value]
+            elif name == 'timestamp':
+                value = timestamp_micros(value)
+            elif name == 'messages':
+                value = [self.pack(message) for message in value]
+            packed[self.FIELD_TAGS[name]] = value
+        return packed
+
+
+def timestamp_micros(value):
+    # Chat events carry ISO 8601 timestamps (they cross the channel layer)
+    moment = datetime.fromisoformat(value) if isinstance(value, str) else value
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    # Exact: microseconds since the epoch stay well below 2**53
+    return round(moment.timestamp() * 1000000)
+
+
+CODECS = {codec.subprotocol: codec for codec in (MsgpackCodec(), JSONCodec())}
+DEFAULT_CODEC = CODECS[JSONCodec.subprotocol]
+
+
+def negotiate(subprotocols):
+    """
+    Return the codec for the first subprotocol the client offered that we
+    support, and the subprotocol to accept (None when it offered none).
+    """
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol], subprotocol
+    return DEFAULT_CODEC, None
@@ -1,137 +1,286 @@
-import json
+import logging
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
+from ApiRoot.instrumentation import Counter, Histogram, InstrumentedConsumerMixin, DURATION_BUCKETS
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from users.models import ChatMessage, Match
-import datetime
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
+from users.models import ChatMessage, Conversation, Match
+from users.cache import mutual_match_cache, presence, response_versions
+from .codec import negotiate
+from .events import (
+    conversation_partner, message_event, presence_event, read_event, send_to_users, typing_event, user_group_name
+)
+from .limits import RateLimitedConsumerMixin
+from .writer import message_writer
+
+logger = logging.getLogger(__name__)
+
+chat_connects = Counter('chat_connects_total', 'Accepted chat sockets', ())
+chat_rejects = Counter('chat_rejects_total', 'Refused chat sockets', ('reason',))
+chat_messages_in = Counter('chat_messages_in_total', 'Chat messages received from clients', ())
+chat_messages_out = Counter('chat_messages_out_total', 'Chat messages delivered to sockets', ())
+chat_fanout = Histogram('chat_fanout_seconds', 'Time to hand a message to the participants\' groups', (), DURATION_BUCKETS)
+
+class ChatConsumer(InstrumentedConsumerMixin, RateLimitedConsumerMixin, AsyncWebsocketConsumer):
+    # One socket per user, joined to the user's group, carrying all of their
+    # conversations, read receipts, match events, and their matches' presence
+    # and typing. Clients send a heartbeat every PRESENCE_TTL / 2 seconds or
+    # so to stay online. Frames are JSON text, or msgpack with the
+    # chat.msgpack.v1 subprotocol (see chat.codec).
+
+    def log(self, level, event, exc_info=False, **fields):
+        # Every chat log line carries the authenticated user
+        fields['user'] = self.scope['user'].id
+        logger.log(level, event, exc_info=exc_info, extra=fields)
+
+    async def reject(self, reason):
+        chat_rejects.inc(reason)
+        self.log(logging.INFO, 'chat socket rejected', reason=reason)
+        await self.close()
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         try:
             if self.scope["user"].is_anonymous:
-                await self.close()
+                await self.reject('anonymous')
                 return
 
-            self.room_name = self.scope['url_route']['kwargs']['room_name']
-            self.room_group_name = f'chat_{self.room_name}'
-            
-            # Verify that the users are matched
-            user_ids = self.room_name.split('_')
-            if len(user_ids) != 2:
-                await self.close()
-                return
-                
-            try:
-                user_a_id, user_b_id = map(int, user_ids)
-                if not await self.verify_match(user_a_id, user_b_id):
-                    await self.close()
-                    return
-            except ValueError:
-                await self.close()
-                return
+            self.codec, subprotocol = negotiate(self.scope.get('subprotocols', ()))
+            self.user_id = self.scope["user"].id
+            # Users this socket has checked it may message; dropped again on
+            # any match change between them
+            self.partners = set()
+            # When a typing event last went out, per partner
+            self.typing_sent = {}
+            self.group_name = user_group_name(self.user_id)
 
-            # Join room group
+            # Join the user's group
             await self.channel_layer.group_add(
-                self.room_group_name,
+                self.group_name,
                 self.channel_name
             )
-            await self.accept()
-            
+            await self.accept(subprotocol)
+            self.connected_at = time.monotonic()
+            chat_connects.inc()
+            self.log(logging.INFO, 'chat socket connected')
+
+            if await presence.connect(self.user_id):
+                await self.presence_changed(True)
+
         except Exception as e:
-            print(f"Connection error: {str(e)}")
+            chat_rejects.inc('error')
+            self.log(logging.ERROR, 'chat connect failed', error=type(e).__name__, exc_info=True)
             await self.close()
 
     async def disconnect(self, close_code):
         try:
-            # Leave room group
-            if hasattr(self, 'room_group_name'):
+            # Don't leave this socket's messages waiting in the write-behind queue
+            await message_writer.flush()
+
+            # Leave the user's group
+            if hasattr(self, 'group_name'):
                 await self.channel_layer.group_discard(
-                    self.room_group_name,
+                    self.group_name,
                     self.channel_name
                 )
+            if hasattr(self, 'connected_at'):
+                if await presence.disconnect(self.user_id):
+                    await self.presence_changed(False)
+                self.log(logging.INFO, 'chat socket disconnected', close_code=close_code,
+                         latency_ms=round((time.monotonic() - self.connected_at) * 1000))
         except Exception as e:
-            print(f"Disconnect error: {str(e)}")
+            self.log(logging.ERROR, 'chat disconnect failed', error=type(e).__name__, exc_info=True)
+
+    async def send_frame(self, frame):
+        text_data, bytes_data = self.codec.encode(frame)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            text_data_json = json.loads(text_data)
-            message = text_data_json['message']
-            sender_id = int(text_data_json['sender_id'])
-            receiver_id = int(text_data_json['receiver_id'])
+            frame = self.codec.decode(text_data, bytes_data)
 
-            # Verify sender is the authenticated user
-            if sender_id != self.scope["user"].id:
+            frame_type = frame.get('type')
+            if frame_type == 'heartbeat':
+                await presence.heartbeat(self.user_id)
                 return
 
-            # Save message to database
-            saved_message = await self.save_message(sender_id, receiver_id, message)
-            
-            # Broadcast message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'id': saved_message.id,
-                    'content': message,
-                    'sender_id': sender_id,
-                    'receiver_id': receiver_id,
-                    'timestamp': saved_message.timestamp.isoformat(),
-                    'is_read': False
-                }
-            )
+            if frame_type == 'typing':
+                other_id = conversation_partner(frame.get('conversation'), self.user_id)
+                if other_id is not None and await self.is_partner(other_id):
+                    await self.receive_typing(other_id)
+                return
+
+            # Read receipts: the client reports the last message it has shown
+            # in a conversation
+            if frame_type == 'read':
+                other_id = conversation_partner(frame.get('conversation'), self.user_id)
+                if other_id is not None and await self.is_partner(other_id):
+                    await self.receive_read(other_id, int(frame['last_read_id']))
+                return
+
+            # A client reconnecting with a backlog asks for everything after
+            # the last message it has
+            if frame_type == 'sync':
+                await self.receive_sync(int(frame['after_id']))
+                return
+
+            message = frame['message']
+            chat_messages_in.inc()
+            receiver_id = int(frame['receiver_id'])
+
+            # Only the authenticated user may send, and only to a mutual match
+            if int(frame.get('sender_id', self.user_id)) != self.user_id:
+                return
+            if not await self.is_partner(receiver_id):
+                await self.send_frame({'error': 'Not matched with this user'})
+                return
+
+            if settings.CHAT_WRITE_BEHIND:
+                # Broadcast right away and let the writer persist it in a batch
+                saved_message = message_writer.enqueue(
+                    ChatMessage(sender_id=self.user_id, receiver_id=receiver_id, content=message)
+                )
+            else:
+                # Save message to database
+                saved_message = await self.save_message(self.user_id, receiver_id, message)
+
+            # Deliver to every socket of both participants
+            start = time.perf_counter()
+            await send_to_users((self.user_id, receiver_id), message_event(saved_message))
+            fanout = time.perf_counter() - start
+            chat_fanout.observe(fanout)
+            self.log(logging.DEBUG, 'chat message sent', message_id=saved_message.id,
+                     receiver=receiver_id, latency_ms=round(fanout * 1000, 2))
         except Exception as e:
-            print(f"Receive error: {str(e)}")
+            self.log(logging.ERROR, 'chat receive failed', error=type(e).__name__, exc_info=True)
             # Send error message back to client
-            await self.send(text_data=json.dumps({
-                'error': 'Failed to send message'
-            }))
+            await self.send_frame({'error': 'Failed to send message'})
+
+    async def is_partner(self, other_id):
+        if other_id not in self.partners:
+            if not await self.verify_match(self.user_id, other_id):
+                return False
+            self.partners.add(other_id)
+        return True
+
+    async def receive_typing(self, other_id):
+        # Keystrokes within TYPING_INTERVAL of the last event sent are
+        # coalesced into it; clients show typing until a few seconds pass
+        # without another event
+        now = time.monotonic()
+        if now - self.typing_sent.get(other_id, float('-inf')) >= settings.TYPING_INTERVAL:
+            self.typing_sent[other_id] = now
+            await send_to_users((other_id,), typing_event(self.user_id, other_id))
+
+    async def presence_changed(self, online):
+        partner_ids = await self.announce_presence()
+        await send_to_users(partner_ids, presence_event(self.user_id, online))
+
+    @database_sync_to_async
+    def announce_presence(self):
+        # Online status is part of the matches' matches lists
+        partner_ids = Match.mutual_partner_ids(self.user_id)
+        response_versions.bump(partner_ids)
+        return partner_ids
+
+    async def receive_sync(self, after_id):
+        # Anything still in the write-behind queue belongs in the backlog too
+        await message_writer.flush()
+        messages = await self.messages_after(after_id)
+        # Always at least one batch, so the client knows it is caught up
+        for start in range(0, max(len(messages), 1), settings.CHAT_BATCH_SIZE):
+            await self.send_frame({'type': 'batch', 'messages': messages[start:start + settings.CHAT_BATCH_SIZE]})
+        chat_messages_out.inc(amount=len(messages))
+
+    @database_sync_to_async
+    def messages_after(self, after_id):
+        # Up to CHAT_SYNC_LIMIT of the oldest messages after `after_id` in
+        # all of this user's conversations, with the recent ones before it
+        # that may have committed late, as message frames
+        messages = ChatMessage.after(
+            ChatMessage.objects.filter(Q(sender_id=self.user_id) | Q(receiver_id=self.user_id)),
+            after_id,
+            settings.CHAT_SYNC_LIMIT
+        )
+        conversations = {
+            conversation.other_user_id(self.user_id): conversation
+            for conversation in Conversation.for_user(self.user_id)
+        }
+        frames = []
+        for message in messages:
+            conversation = conversations.get(message.receiver_id if message.sender_id == self.user_id else message.sender_id)
+            frames.append(dict(
+                message_event(message),
+                type='message',
+                is_read=conversation.is_read(message) if conversation else False
+            ))
+        return frames
+
+    async def receive_read(self, other_id, last_read_id):
+        last_read_id = await self.mark_read(self.user_id, other_id, last_read_id)
+        if last_read_id is not None:
+            await send_to_users((self.user_id, other_id), read_event(self.user_id, other_id, last_read_id))
+
+    async def read_receipt(self, event):
+        try:
+            await self.send_frame(dict(event, type='read'))
+        except Exception as e:
+            self.log(logging.ERROR, 'chat read receipt failed', error=type(e).__name__, exc_info=True)
+
+    async def presence_update(self, event):
+        await self.send_frame(dict(event, type='presence'))
+
+    async def typing(self, event):
+        await self.send_frame(event)
+
+    async def match_update(self, event):
+        try:
+            other_id = next((user_id for user_id in event['user_ids'] if user_id != self.user_id), self.user_id)
+            # Check the match again before the next message to this user
+            self.partners.discard(other_id)
+            await self.send_frame({'type': 'match', 'event': event['event'], 'user_id': other_id})
+        except Exception as e:
+            self.log(logging.ERROR, 'chat match event failed', error=type(e).__name__, exc_info=True)
 
     async def chat_message(self, event):
         try:
             # Send message to WebSocket
             if 'error' in event:
-                await self.send(text_data=json.dumps({
-                    'error': event['error']
-                }))
+                await self.send_frame({'error': event['error']})
             else:
-                await self.send(text_data=json.dumps({
-                    'id': event['id'],
-                    'content': event['content'],
-                    'sender_id': event['sender_id'],
-                    'receiver_id': event['receiver_id'],
-                    'timestamp': event['timestamp'],
-                    'is_read': event['is_read']
-                }))
+                await self.send_frame(dict(event, type='message'))
+                chat_messages_out.inc()
         except Exception as e:
-            print(f"Chat message error: {str(e)}")
+            self.log(logging.ERROR, 'chat delivery failed', error=type(e).__name__, exc_info=True)
 
     @database_sync_to_async
     def save_message(self, sender_id, receiver_id, content):
         try:
-            User = get_user_model()
-            sender = User.objects.get(id=sender_id)
-            receiver = User.objects.get(id=receiver_id)
-            return ChatMessage.objects.create(
-                sender=sender,
-                receiver=receiver,
-                content=content
-            )
+            # The match was checked before sending, so no need to load the users
+            with transaction.atomic():
+                message = ChatMessage.objects.create(
+                    sender_id=sender_id,
+                    receiver_id=receiver_id,
+                    content=content
+                )
+                Conversation.record_messages([message])
+            return message
         except Exception as e:
-            print(f"Save message error: {str(e)}")
+            self.log(logging.ERROR, 'chat message save failed', error=type(e).__name__, exc_info=True)
             raise
 
+    @database_sync_to_async
+    def mark_read(self, reader_id, other_id, last_read_id):
+        # The cursor actually stored, which may be behind what the client sent
+        conversation = Conversation.mark_read(reader_id, other_id, last_read_id)
+        return conversation.last_read(reader_id) if conversation else None
+
     @database_sync_to_async
     def verify_match(self, user_a_id, user_b_id):
         try:
             # Check if users have a mutual match
-            match = Match.objects.filter(
-                (Q(user_a_id=user_a_id, user_b_id=user_b_id) |
-                Q(user_a_id=user_b_id, user_b_id=user_a_id)),
-                status_a='accepted',
-                status_b='accepted'
-            ).exists()
-            return match
+            return mutual_match_cache.get(user_a_id, user_b_id)
         except Exception as e:
-            print(f"Verify match error: {str(e)}")
-            return False 
\ No newline at end of file
+            self.log(logging.ERROR, 'chat match check failed', error=type(e).__name__, exc_info=True)
+            return False
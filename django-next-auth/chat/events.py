@@ -0,0 +1,83 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+# Every chat socket belongs to its user's group and carries the events of all
+# of that user's conversations, each tagged with its conversation id.
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+def conversation_id(user_a_id, user_b_id):
+    # The same id for both participants whichever order they are named in
+    return f'{min(user_a_id, user_b_id)}_{max(user_a_id, user_b_id)}'
+
+
+def conversation_partner(conversation, user_id):
+    # The other participant of `conversation`, or None if `user_id` isn't in it
+    try:
+        user_ids = [int(part) for part in conversation.split('_')]
+    except (AttributeError, ValueError):
+        return None
+    if len(user_ids) != 2 or user_id not in user_ids:
+        return None
+    return user_ids[1] if user_ids[0] == user_id else user_ids[0]
+
+
+def message_event(message):
+    return {
+        'type': 'chat_message',
+        'conversation': conversation_id(message.sender_id, message.receiver_id),
+        'id': message.id,
+        'content': message.content,
+        'sender_id': message.sender_id,
+        'receiver_id': message.receiver_id,
+        'timestamp': message.timestamp.isoformat(),
+        'is_read': False
+    }
+
+
+def read_event(reader_id, other_id, last_read_id):
+    return {
+        'type': 'read_receipt',
+        'conversation': conversation_id(reader_id, other_id),
+        'reader_id': reader_id,
+        'last_read_id': last_read_id
+    }
+
+
+def presence_event(user_id, online):
+    return {
+        'type': 'presence_update',
+        'user_id': user_id,
+        'online': online
+    }
+
+
+def typing_event(user_id, other_id):
+    return {
+        'type': 'typing',
+        'conversation': conversation_id(user_id, other_id),
+        'user_id': user_id
+    }
+
+
+def match_event(match, event):
+    # event is 'requested', 'updated', 'matched' or 'unmatched'
+    return {
+        'type': 'match_update',
+        'event': event,
+        'user_ids': [match.user_a_id, match.user_b_id]
+    }
+
+
+async def send_to_users(user_ids, event):
+    channel_layer = get_channel_layer()
+    for user_id in set(user_ids):
+        await channel_layer.group_send(user_group_name(user_id), event)
+
+
+def notify_users(user_ids, event):
+    # For sync code: views and model signals
+    async_to_sync(send_to_users)(user_ids, event)
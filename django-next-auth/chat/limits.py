@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+import weakref
+
+from django.conf import settings
+
+from ApiRoot.instrumentation import Counter
+
+logger = logging.getLogger(__name__)
+
+# Close codes sent to clients
+CLOSE_TOO_BIG = 1009
+CLOSE_SLOW_CONSUMER = 4008
+
+rate_limited = Counter('chat_rate_limited_total', 'Chat frames dropped by a rate limit', ('scope',))
+oversized = Counter('chat_oversized_total', 'Chat sockets closed for an oversized frame', ())
+slow_consumers = Counter('chat_slow_consumers_total', 'Chat sockets closed with a full send queue', ())
+
+
+class TokenBucket:
+    # `rate` tokens per second, holding at most `burst`
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', '__weakref__')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# One bucket per user shared by all of that user's sockets in this process.
+# Sockets hold their user's bucket, so it goes away with the last of them
+_user_buckets = weakref.WeakValueDictionary()
+
+
+def user_bucket(user_id, rate, burst):
+    bucket = _user_buckets.get(user_id)
+    if bucket is None:
+        bucket = _user_buckets[user_id] = TokenBucket(rate, burst)
+    return bucket
+
+
+class RateLimitedConsumerMixin:
+    """
+    Bounds what one socket can cost everybody else:
+
+    - frames over CHAT_MAX_MESSAGE_BYTES close the socket before they are
+      decoded;
+    - frames over the per-connection or per-user token bucket
+      (CHAT_RATE_LIMITS) are dropped and answered with an error;
+    - outgoing frames go through a queue of CHAT_SEND_QUEUE_SIZE drained by
+      a task of its own, so a group event never waits on a slow client, and
+      a client that lets the queue fill up is disconnected.
+    """
+
+    def frame_size(self, text_data, bytes_data):
+        if text_data is None:
+            return len(bytes_data or b'')
+        # A str is at most 4 bytes per character, so only encode near the limit
+        if len(text_data) * 4 > settings.CHAT_MAX_MESSAGE_BYTES:
+            return len(text_data.encode())
+        return len(text_data)
+
+    def within_rate_limits(self):
+        limits = settings.CHAT_RATE_LIMITS
+        if limits is None:
+            return True
+        if not hasattr(self, 'rate_buckets'):
+            self.rate_buckets = (
+                ('connection', TokenBucket(*limits['connection'])),
+                ('user', user_bucket(self.scope['user'].id, *limits['user'])),
+            )
+        for scope, bucket in self.rate_buckets:
+            if not bucket.take():
+                rate_limited.inc(scope)
+                return False
+        return True
+
+    async def websocket_receive(self, message):
+        if getattr(self, 'closing', False):
+            return
+        size = self.frame_size(message.get('text'), message.get('bytes'))
+        if size > settings.CHAT_MAX_MESSAGE_BYTES:
+            oversized.inc()
+            logger.info('Closing chat socket for a %d byte frame', size, extra={'user': self.scope['user'].id})
+            self.closing = True
+            await self.close(code=CLOSE_TOO_BIG)
+        elif not self.within_rate_limits():
+            await self.send_frame({'error': 'Rate limit exceeded'})
+        else:
+            await super().websocket_receive(message)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if getattr(self, 'closing', False):
+            return
+        if not hasattr(self, 'outbox'):
+            self.outbox = asyncio.Queue(settings.CHAT_SEND_QUEUE_SIZE)
+            self.drain_task = asyncio.ensure_future(self.drain())
+        if self.outbox.full():
+            slow_consumers.inc()
+            logger.warning('Closing slow chat socket with %d frames queued', self.outbox.qsize(),
+                           extra={'user': self.scope['user'].id})
+            self.closing = True
+            self.drain_task.cancel()
+            await self.close(code=CLOSE_SLOW_CONSUMER)
+            return
+        self.outbox.put_nowait((text_data, bytes_data, close))
+
+    async def drain(self):
+        while True:
+            text_data, bytes_data, close = await self.outbox.get()
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def websocket_disconnect(self, message):
+        if hasattr(self, 'drain_task'):
+            self.drain_task.cancel()
+        await super().websocket_disconnect(message)
@@ -0,0 +1,64 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# Chat logging runs on the event loop, so records are only queued there and
+# a listener thread formats and writes them. Configured for the 'chat'
+# logger in settings.LOGGING.
+
+# Attributes every LogRecord has; anything else was passed in `extra`
+RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger and event, followed by
+    the fields passed in `extra` (room, user, latency_ms, error, ...).
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Queues records for a listener thread that writes them to `stream`
+    (stderr by default). The formatter set on this handler is used by the
+    listener, so formatting happens off the event loop too.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Freeze the message and traceback now; the rest is left to the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
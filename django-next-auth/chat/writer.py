@@ -0,0 +1,154 @@
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from users.models import ChatMessage, Conversation
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """
+    Write-behind buffer for chat messages (CHAT_WRITE_BEHIND).
+
+    The consumer broadcasts a message as soon as it has been given its id and
+    timestamp, and this writer persists queued messages with one bulk_create
+    every `flush_interval` seconds or as soon as `batch_size` are waiting.
+
+    Durability: a message is acknowledged to clients before it is written.
+    Queued messages are flushed when a chat socket disconnects, on ASGI
+    lifespan shutdown, and at interpreter exit for servers without lifespan
+    support (daphne), but a crash or SIGKILL of the worker loses whatever was
+    queued (at most one interval or one batch). A failed flush is retried on
+    the next tick up to `max_retries` times; after that the batch is written
+    one message at a time and only the messages that still fail (say, to a
+    since deleted user) are dropped and logged. Until a message is flushed
+    it is missing from chat history reads; clients that have seen a later
+    id get it from the overlap that syncs and polls resend (see
+    ChatMessage.after).
+    """
+
+    def __init__(self, flush_interval, batch_size, max_retries=3):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self._pending = []
+        self._retries = 0
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._flush_lock = None
+
+    def _bind_loop(self):
+        # The writer's task and primitives belong to the running event loop
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = None
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    def enqueue(self, message):
+        self._bind_loop()
+        self._pending.append(message)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return message
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        # Wait for a flush already in flight even when nothing is queued, so
+        # whoever flushes before reading sees that batch too
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                await database_sync_to_async(self.write)(batch)
+                self._retries = 0
+            except Exception:
+                self._retries += 1
+                if self._retries > self.max_retries:
+                    logger.exception('Writing %d chat messages one at a time after %d failed flushes', len(batch), self._retries)
+                    self._retries = 0
+                    await database_sync_to_async(self.write_each)(batch)
+                else:
+                    logger.exception('Chat message flush failed, retrying %d messages', len(batch))
+                    self._pending = batch + self._pending
+
+    def write(self, batch):
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(batch)
+            Conversation.record_messages(batch)
+
+    def write_each(self, batch):
+        # One bad row shouldn't lose everyone else's messages with it
+        for message in batch:
+            try:
+                self.write([message])
+            except Exception:
+                logger.exception('Dropping chat message %s', message.id)
+
+    def flush_sync(self):
+        # For when there is no event loop left to run flush() on
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            self.write(batch)
+        except Exception:
+            logger.exception('Writing %d chat messages one at a time after a failed final flush', len(batch))
+            self.write_each(batch)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+message_writer = MessageWriter(
+    flush_interval=getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL_MS', 50) / 1000,
+    batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100),
+)
+
+# daphne has no ASGI lifespan, but stops its reactor on SIGTERM/SIGINT and
+# then exits normally, so whatever is still queued is written here
+atexit.register(message_writer.flush_sync)
+
+
+async def lifespan(scope, receive, send):
+    # ASGI lifespan handler so servers that support it (e.g. uvicorn) flush
+    # queued messages while the event loop is still running
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await message_writer.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
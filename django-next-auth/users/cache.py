@@ -0,0 +1,325 @@
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """
+    Short-lived, size-bounded LRU of users with their profile attached, keyed
+    by user id. It is local to each process: saves invalidate the entry in
+    the process that made them, and the TTL bounds staleness everywhere else.
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def peek(self, user_id):
+        # Return a copy of the cached user without touching the database
+        user_id = get_user_model()._meta.pk.to_python(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            user = entry[1]
+        return self._copy(user)
+
+    def get(self, user_id):
+        user_id = get_user_model()._meta.pk.to_python(user_id)
+        user = self.peek(user_id)
+        if user is not None:
+            return user
+
+        with self._lock:
+            self.misses += 1
+        try:
+            user = get_user_model().objects.select_related('profile').get(id=user_id)
+        except get_user_model().DoesNotExist:
+            return None
+
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return self._copy(user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _copy(self, user):
+        # Requests mutate and save request.user, so never hand out the shared
+        # cached instance
+        clone = copy.copy(user)
+        try:
+            clone.profile = copy.copy(user.profile)
+        except ObjectDoesNotExist:
+            pass
+        return clone
+
+
+user_cache = UserCache(
+    ttl=getattr(settings, 'USER_CACHE_TTL', 30),
+    max_size=getattr(settings, 'USER_CACHE_MAX_SIZE', 1024),
+)
+
+
+class MutualMatchCache:
+    """
+    Mutual-match status per user pair in the configured Django cache (local
+    memory per process, or shared through Redis), kept current by Match
+    saves and deletes. Negative answers are cached too, so reconnect storms
+    against unmatched rooms don't reach the database either.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def key(self, user_a_id, user_b_id):
+        return f'mutual_match:{min(user_a_id, user_b_id)}:{max(user_a_id, user_b_id)}'
+
+    def get(self, user_a_id, user_b_id):
+        key = self.key(user_a_id, user_b_id)
+        is_mutual = cache.get(key)
+        if is_mutual is None:
+            from .models import Match
+            is_mutual = Match.for_pair(user_a_id, user_b_id).filter(
+                status_a=Match.ACCEPTED,
+                status_b=Match.ACCEPTED
+            ).exists()
+            cache.set(key, is_mutual, self.ttl)
+        return is_mutual
+
+    def set(self, user_a_id, user_b_id, is_mutual):
+        cache.set(self.key(user_a_id, user_b_id), is_mutual, self.ttl)
+
+
+mutual_match_cache = MutualMatchCache(
+    ttl=getattr(settings, 'MUTUAL_MATCH_CACHE_TTL', 300),
+)
+
+
+class ResponseVersions:
+    """
+    Per-user versions in the Django cache. Every save that changes what a
+    user's profile, matches, match requests or potential-match feed would
+    return bumps that user's version, so conditional GETs can be answered
+    from the version alone.
+
+    A version is the clock reading when it was created. Bumping deletes it
+    (one round trip for any number of users) and the next get() starts a
+    new one, which never repeats a value an old ETag was built from.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def key(self, user_id):
+        return f'response_version:{user_id}'
+
+    def get(self, user_id):
+        key = self.key(user_id)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, time.time_ns(), self.ttl)
+            version = cache.get(key)
+        return version
+
+    def bump(self, user_ids):
+        # Bump once the change is committed, so a reader that sees the new
+        # version also sees the new data
+        user_ids = set(user_ids)
+        if user_ids:
+            transaction.on_commit(lambda: self._bump(user_ids))
+
+    def _bump(self, user_ids):
+        cache.delete_many([self.key(user_id) for user_id in user_ids])
+
+
+response_versions = ResponseVersions(
+    ttl=getattr(settings, 'RESPONSE_VERSION_TTL', 60 * 60 * 24),
+)
+
+
+class PotentialMatchesCache:
+    """
+    Per-user cache of potential-match pages with stale-while-revalidate.
+
+    An entry is fresh while it was built from the user's current response
+    version and is younger than `ttl`. Bumping a version (see
+    ResponseVersions) only marks the user's entries stale: they keep being
+    served, up to `stale_ttl` old, while a single background refresh
+    rebuilds the requested page. invalidate() drops them outright, for
+    changes the user must see on their next request (their own subjects,
+    their own swipes).
+
+    Every page has its own key, so storing one never rewrites another.
+    Pages name the generation of the user's marker key they were built
+    under; invalidate() deletes the marker, which orphans all of them at
+    once, and a page built across an invalidation is stored under the old
+    generation and never served.
+    """
+
+    def __init__(self, ttl, stale_ttl, workers):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='potential-matches')
+
+    def key(self, user_id):
+        return f'potential_matches:{user_id}'
+
+    def page_key(self, user_id, page):
+        return f'{self.key(user_id)}:page:{page}'
+
+    def get(self, user_id, page, version, build):
+        """
+        Return `page` of the user's feed and the response version it was
+        built from, calling `build()` on a miss.
+        """
+        key, page_key = self.key(user_id), self.page_key(user_id, page)
+        found = cache.get_many([key, page_key])
+        generation, entry = found.get(key), found.get(page_key)
+        if generation is not None and entry is not None and entry['generation'] == generation:
+            age = time.time() - entry['built_at']
+            if entry['version'] == version and age < self.ttl:
+                return entry['payload'], entry['version']
+            if age < self.stale_ttl:
+                self._revalidate(user_id, page, generation, version, build)
+                return entry['payload'], entry['version']
+        if generation is None:
+            cache.add(key, time.time_ns(), self.stale_ttl)
+            generation = cache.get(key)
+        return self._store(user_id, page, generation, version, build()), version
+
+    def invalidate(self, user_ids):
+        user_ids = set(user_ids)
+        if user_ids:
+            transaction.on_commit(lambda: cache.delete_many([self.key(user_id) for user_id in user_ids]))
+
+    def _store(self, user_id, page, generation, version, payload):
+        cache.set(self.page_key(user_id, page), {
+            'generation': generation,
+            'version': version,
+            'built_at': time.time(),
+            'payload': payload,
+        }, self.stale_ttl)
+        # Keep the marker alive as long as the page
+        cache.touch(self.key(user_id), self.stale_ttl)
+        return payload
+
+    def _revalidate(self, user_id, page, generation, version, build):
+        # At most one refresh per page in flight, across processes when the
+        # cache is shared
+        lock = f'{self.page_key(user_id, page)}:refreshing'
+        if cache.add(lock, True, 30):
+            self._executor.submit(self._refresh, lock, user_id, page, generation, version, build)
+
+    def _refresh(self, lock, user_id, page, generation, version, build):
+        close_old_connections()
+        try:
+            self._store(user_id, page, generation, version, build())
+        except Exception:
+            logger.exception('Refreshing potential matches for user %s failed', user_id)
+        finally:
+            cache.delete(lock)
+            connection.close()
+
+
+potential_matches_cache = PotentialMatchesCache(
+    ttl=getattr(settings, 'POTENTIAL_MATCHES_CACHE_TTL', 300),
+    stale_ttl=getattr(settings, 'POTENTIAL_MATCHES_STALE_TTL', 60 * 60),
+    workers=getattr(settings, 'POTENTIAL_MATCHES_REFRESH_WORKERS', 2),
+)
+
+
+class PresenceRegistry:
+    """
+    Online status per user in the configured Django cache (local memory per
+    process, or shared through Redis): a count of the user's open chat
+    sockets. The count expires `ttl` seconds after the last heartbeat, so
+    sockets lost with a crashed worker don't keep a user online for good.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+
+    def key(self, user_id):
+        return f'presence:{user_id}'
+
+    async def connect(self, user_id):
+        # Returns whether the user has just come online
+        key = self.key(user_id)
+        await cache.aadd(key, 0, self.ttl)
+        try:
+            count = await cache.aincr(key)
+        except ValueError:
+            # Expired between the add and the increment
+            await cache.aset(key, 1, self.ttl)
+            count = 1
+        await cache.atouch(key, self.ttl)
+        return count == 1
+
+    async def disconnect(self, user_id):
+        # Returns whether the user's last socket has gone
+        key = self.key(user_id)
+        try:
+            count = await cache.adecr(key)
+        except ValueError:
+            return False
+        if count <= 0:
+            await cache.adelete(key)
+            return True
+        return False
+
+    async def heartbeat(self, user_id):
+        key = self.key(user_id)
+        if not await cache.atouch(key, self.ttl):
+            # Expired while the socket was still open
+            await cache.aadd(key, 1, self.ttl)
+
+    def online(self, user_ids):
+        keys = {user_id: self.key(user_id) for user_id in user_ids}
+        counts = cache.get_many(keys.values())
+        return {user_id for user_id, key in keys.items() if counts.get(key, 0) > 0}
+
+
+presence = PresenceRegistry(
+    ttl=getattr(settings, 'PRESENCE_TTL', 60),
+)
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Time-ordered 53-bit message ids, so the server can hand out an id before
+# the row is written and clients (JavaScript numbers) can still hold it:
+#
+#   | 41 bits: ms since EPOCH_MS | 4 bits: worker | 8 bits: sequence |
+#
+# Ids are unique as long as every process writing messages at the same time
+# has a distinct worker id (MESSAGE_ID_WORKER, 0-15). Settings refuse to load
+# without one where writers can be on several hosts. Otherwise (SQLite) a
+# process without one claims the first id no other process on the host
+# holds, by locking that id's byte of MESSAGE_ID_LOCK_FILE until it exits.
+
+EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+WORKER_BITS = 4
+SEQUENCE_BITS = 8
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class MessageIdGenerator:
+    def __init__(self, worker_id):
+        if not 0 <= worker_id < (1 << WORKER_BITS):
+            raise ValueError(f'Message id worker must be between 0 and {(1 << WORKER_BITS) - 1}')
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def __call__(self):
+        with self._lock:
+            now_ms = int(time.time() * 1000) - EPOCH_MS
+            # Never go backwards, even if the clock does
+            if now_ms < self._last_ms:
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    # Sequence exhausted for this millisecond; borrow the next one
+                    now_ms += 1
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (now_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+
+def earlier_message_id(message_id, ms):
+    # The smallest id a message generated `ms` before `message_id` can have
+    return max((message_id >> (WORKER_BITS + SEQUENCE_BITS)) - ms, 0) << (WORKER_BITS + SEQUENCE_BITS)
+
+
+_generator = None
+_generator_pid = None
+_generator_lock = threading.Lock()
+_claimed = []
+
+
+def claim_worker_id(path):
+    try:
+        import fcntl
+    except ImportError:
+        raise ImproperlyConfigured('Set MESSAGE_ID_WORKER: worker ids can only be claimed on POSIX systems')
+    lock_file = open(path, 'ab')
+    for worker_id in range(1 << WORKER_BITS):
+        try:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, worker_id)
+        except OSError:
+            continue
+        # Closing the file would release the lock
+        _claimed.append(lock_file)
+        return worker_id
+    lock_file.close()
+    raise ImproperlyConfigured(f'Every message id worker is held by another process writing messages ({path})')
+
+
+def generate_message_id():
+    global _generator, _generator_pid
+    # A forked child doesn't inherit its parent's locks, so it claims its own id
+    if _generator is None or _generator_pid != os.getpid():
+        with _generator_lock:
+            if _generator is None or _generator_pid != os.getpid():
+                worker_id = getattr(settings, 'MESSAGE_ID_WORKER', None)
+                if worker_id is None:
+                    worker_id = claim_worker_id(settings.MESSAGE_ID_LOCK_FILE)
+                _generator = MessageIdGenerator(int(worker_id))
+                _generator_pid = os.getpid()
+    return _generator()
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Profile pictures are stored under the SHA-256 of the uploaded bytes, so the
+# same image uploaded twice is stored once and every URL is immutable (safe
+# to serve with a far-future Cache-Control). The original is re-encoded
+# without metadata during the request, before the profile is locked;
+# thumbnailing happens in a small worker pool after the request has
+# committed, and the profile only points at the thumbnail once it exists,
+# falling back to the original until then.
+
+UPLOAD_DIR = 'profile_pictures'
+MAX_UPLOAD_BYTES = getattr(settings, 'PROFILE_PICTURE_MAX_BYTES', 10 * 1024 * 1024)
+MAX_PIXELS = getattr(settings, 'PROFILE_PICTURE_MAX_PIXELS', 40 * 1000 * 1000)
+THUMBNAIL_SIZE = getattr(settings, 'PROFILE_THUMBNAIL_SIZE', (256, 256))
+THUMBNAIL_FORMAT = getattr(settings, 'PROFILE_THUMBNAIL_FORMAT', 'WEBP')
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+    thread_name_prefix='profile-pictures'
+)
+
+
+def picture_names(digest):
+    return (
+        f'{UPLOAD_DIR}/{digest}.jpg',
+        f'{UPLOAD_DIR}/{digest}_{THUMBNAIL_SIZE[0]}.{EXTENSIONS[THUMBNAIL_FORMAT]}',
+    )
+
+
+def prepare_profile_picture(upload):
+    """
+    Check and decode `upload` and store the re-encoded original under its
+    content-addressed name. Call it before taking the profile's row lock:
+    decoding and encoding can take long enough to stall every other
+    writer. Returns what set_profile_picture() needs.
+    """
+    if upload.size > MAX_UPLOAD_BYTES:
+        raise ValueError('Profile picture is too large')
+
+    data = upload.read()
+    try:
+        image = open_image(data)
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise ValueError('Profile picture is not a valid image')
+
+    digest = hashlib.sha256(data).hexdigest()
+    picture_name, thumbnail_name = picture_names(digest)
+    if not default_storage.exists(picture_name):
+        default_storage.save(picture_name, ContentFile(encode(image, 'JPEG')))
+    return image, picture_name, thumbnail_name
+
+
+def set_profile_picture(profile, picture):
+    """
+    Point `profile` at a picture from prepare_profile_picture() and
+    thumbnail it in the background once the surrounding transaction
+    commits. The caller saves the profile.
+    """
+    image, picture_name, thumbnail_name = picture
+    profile.profile_picture.name = picture_name
+
+    if default_storage.exists(thumbnail_name):
+        profile.profile_thumbnail.name = thumbnail_name
+    else:
+        # Cards use the original until the thumbnail has been written
+        profile.profile_thumbnail.name = None
+        profile_id = profile.pk
+        transaction.on_commit(
+            lambda: _executor.submit(process_profile_picture, profile_id, image, picture_name, thumbnail_name)
+        )
+
+
+def open_image(data):
+    # Opening only reads the header, so the size is checked before any
+    # pixels are decoded. Pillow's own DecompressionBombError only fires
+    # far above anything a profile picture needs
+    image = Image.open(BytesIO(data))
+    if image.width * image.height > MAX_PIXELS:
+        raise ValueError('Profile picture has too many pixels')
+    # Decode once, apply the EXIF orientation, then re-encode from pixels
+    # only, which drops EXIF/GPS and any other metadata
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def process_profile_picture(profile_id, image, picture_name, thumbnail_name):
+    from .models import Profile
+
+    close_old_connections()
+    try:
+        if not default_storage.exists(thumbnail_name):
+            thumbnail = ImageOps.fit(image, THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+            default_storage.save(thumbnail_name, ContentFile(encode(thumbnail, THUMBNAIL_FORMAT)))
+        with transaction.atomic():
+            # Unless another picture has been uploaded since
+            profile = Profile.objects.select_for_update().filter(pk=profile_id, profile_picture=picture_name).first()
+            if profile is not None:
+                profile.profile_thumbnail.name = thumbnail_name
+                profile.save(update_fields=['profile_thumbnail'])
+    except Exception:
+        logger.exception('Failed to thumbnail profile picture %s', picture_name)
+    finally:
+        connection.close()
+
+
+def encode(image, format):
+    buffer = BytesIO()
+    if format == 'WEBP':
+        image.save(buffer, format='WEBP', quality=80, method=4)
+    else:
+        image.save(buffer, format='JPEG', quality=85, optimize=True, progressive=True)
+    return buffer.getvalue()
@@ -0,0 +1,261 @@
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Greatest, Least
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.models import Profile, ProfileSubject, Subject
+
+# Shared helpers for the benchmark commands. Modules starting with an
+# underscore are not picked up as commands by Django.
+
+SUBJECTS = [f'Subject {i}' for i in range(2000)]
+
+
+@contextmanager
+def test_database(name=None, options=None):
+    # Benchmarks always run against a throwaway test database. `name` puts
+    # it in a file (SQLite tests default to memory) and `options` replaces
+    # the connection OPTIONS while it exists
+    settings_dict = connection.settings_dict
+    old_test, old_options = dict(settings_dict['TEST']), settings_dict.get('OPTIONS', {})
+    if name is not None:
+        settings_dict['TEST']['NAME'] = name
+    if options is not None:
+        connection.close()
+        settings_dict['OPTIONS'] = options
+
+    # DEBUG off, as in production: no query log, no debug error pages
+    setup_test_environment(debug=False)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        settings_dict['TEST'], settings_dict['OPTIONS'] = old_test, old_options
+
+
+def sample_subjects(rng, subjects, count, weights=None):
+    if weights is None:
+        return rng.sample(subjects, count)
+    picked = []
+    while len(picked) < count:
+        name = rng.choices(subjects, weights)[0]
+        if name not in picked:
+            picked.append(name)
+    return picked
+
+
+def seed_profiles(count, start=0, subjects=None, subjects_per_side=3, batch_size=2000, rng=None, popularity=None):
+    """
+    Bulk create `count` onboarded users with profiles and subject index rows.
+    Signals are bypassed, so the index is written directly. With
+    `popularity`, subjects are drawn from a Zipf distribution with that
+    exponent (a few very common subjects, a long tail of rare ones) instead
+    of uniformly.
+    """
+    User = get_user_model()
+    rng = rng or random.Random(0)
+    subjects = subjects or SUBJECTS
+    weights = [1 / (rank + 1) ** popularity for rank in range(len(subjects))] if popularity else None
+
+    Subject.objects.bulk_create([Subject(name=name) for name in subjects], ignore_conflicts=True)
+    subject_ids = dict(Subject.objects.filter(name__in=subjects).values_list('name', 'id'))
+
+    for offset in range(start, start + count, batch_size):
+        size = min(batch_size, start + count - offset)
+        users = User.objects.bulk_create([
+            User(email=f'bench{offset + i}@example.com', username=f'bench{offset + i}', password='!')
+            for i in range(size)
+        ])
+        if users[0].pk is None:
+            users = list(User.objects.filter(email__in=[u.email for u in users]))
+
+        profiles = []
+        for user in users:
+            need = sample_subjects(rng, subjects, subjects_per_side, weights)
+            teach = sample_subjects(rng, subjects, subjects_per_side, weights)
+            profiles.append(Profile(
+                user=user,
+                school=f'School {rng.randrange(50)}',
+                subjects_need_help=need,
+                subjects_can_teach=teach,
+                is_onboarded=True
+            ))
+        profiles = Profile.objects.bulk_create(profiles)
+        if profiles[0].pk is None:
+            profiles = list(Profile.objects.filter(user__in=users))
+
+        ProfileSubject.objects.bulk_create([
+            ProfileSubject(profile=profile, subject_id=subject_ids[name], kind=kind)
+            for profile in profiles
+            for kind, names in ((ProfileSubject.NEED, profile.subjects_need_help),
+                                (ProfileSubject.TEACH, profile.subjects_can_teach))
+            for name in names
+        ])
+
+
+def seed_matches(per_user, mutual_ratio=0.5, rng=None):
+    """
+    Bulk create Match rows between users that are each other's candidates,
+    roughly `per_user` per user, `mutual_ratio` of them accepted by both
+    sides and the rest waiting on user_b. Returns the mutual pairs.
+    """
+    from users.models import Match, MatchCandidate
+
+    rng = rng or random.Random(0)
+    candidates = defaultdict(list)
+    for user_id, candidate_id in MatchCandidate.objects.values_list('user_id', 'candidate_id'):
+        candidates[user_id].append(candidate_id)
+
+    pairs = set()
+    for user_id, others in candidates.items():
+        for other_id in rng.sample(others, min(per_user, len(others))):
+            pairs.add(Match.pair_key(user_id, other_id))
+
+    matches, mutual = [], []
+    for low, high in sorted(pairs):
+        accepted = rng.random() < mutual_ratio
+        matches.append(Match(
+            user_a_id=low,
+            user_b_id=high,
+            status_a=Match.ACCEPTED,
+            status_b=Match.ACCEPTED if accepted else Match.PENDING,
+            pair_low=low,
+            pair_high=high
+        ))
+        if accepted:
+            mutual.append((low, high))
+    Match.objects.bulk_create(matches, batch_size=2000)
+    MatchCandidate.objects.filter(Exists(Match.objects.filter(
+        pair_low=Least(OuterRef('user_id'), OuterRef('candidate_id')),
+        pair_high=Greatest(OuterRef('user_id'), OuterRef('candidate_id'))
+    ))).update(has_match=True)
+    return mutual
+
+
+def seed_conversations(pairs, messages, unread=3, rng=None):
+    """
+    Bulk create a chat history of `messages` per pair, spread over the last
+    week, and the Conversation rows with each side's last `unread` incoming
+    messages unread.
+    """
+    from users.ids import generate_message_id
+    from users.models import ChatMessage, Conversation
+    from users.search import index_messages
+
+    rng = rng or random.Random(0)
+    now = timezone.now()
+    batch, conversations = [], []
+    for low, high in pairs:
+        start = now - timedelta(days=7)
+        step = timedelta(days=7) / max(messages, 1)
+        history = []
+        for i in range(messages):
+            sender, receiver = (low, high) if rng.random() < 0.5 else (high, low)
+            history.append(ChatMessage(
+                id=generate_message_id(),
+                sender_id=sender,
+                receiver_id=receiver,
+                content=f'message {i}',
+                timestamp=start + step * i
+            ))
+        conversation = Conversation(user_low_id=low, user_high_id=high)
+        if history:
+            conversation.last_message_id = history[-1].id
+            conversation.last_sender_id = history[-1].sender_id
+            conversation.last_timestamp = history[-1].timestamp
+            conversation.last_preview = history[-1].content
+        for side, user_id in (('low', low), ('high', high)):
+            incoming = [message.id for message in history if message.receiver_id == user_id]
+            read = incoming[:-unread] if unread else incoming
+            setattr(conversation, f'last_read_{side}', read[-1] if read else 0)
+            setattr(conversation, f'unread_{side}', len(incoming) - len(read))
+        conversations.append(conversation)
+        batch.extend(history)
+        if len(batch) >= 5000:
+            ChatMessage.objects.bulk_create(batch)
+            index_messages(batch)
+            batch = []
+    ChatMessage.objects.bulk_create(batch)
+    index_messages(batch)
+    Conversation.objects.bulk_create(conversations, batch_size=2000)
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    samples = sorted(samples)
+    if not samples:
+        return {f'p{point}': 0.0 for point in points}
+    return {
+        f'p{point}': samples[min(len(samples) - 1, int(len(samples) * point / 100))]
+        for point in points
+    }
+
+
+def time_call(func, repeat=20, warmup=2):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'mean': statistics.fmean(samples),
+    }
+
+
+async def run_chat_pairs(application, pairs, count):
+    """
+    Send `count` messages per (sender, receiver) pair through ChatConsumer,
+    all pairs concurrently, and return the seconds until every message was
+    delivered and flushed.
+    """
+    from chat.writer import message_writer
+
+    async def conversation(a, b):
+        sender = WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(a)}')
+        receiver = WebsocketCommunicator(application, f'/ws/chat/?token={AccessToken.for_user(b)}')
+        await sender.connect()
+        await receiver.connect()
+        for i in range(count):
+            await sender.send_json_to({'message': f'message {i}', 'sender_id': a.id, 'receiver_id': b.id})
+        for _ in range(count):
+            await receiver.receive_json_from(timeout=30)
+        await sender.disconnect()
+        await receiver.disconnect()
+
+    start = time.perf_counter()
+    # Benchmark clients send far faster than anyone types
+    with override_settings(CHAT_RATE_LIMITS=None):
+        await asyncio.gather(*[conversation(a, b) for a, b in pairs])
+    await message_writer.close()
+    return time.perf_counter() - start
+
+
+def create_chat_pairs(count, prefix='ingest'):
+    from users.models import Match
+
+    User = get_user_model()
+    pairs = []
+    for i in range(count):
+        a = User.objects.create_user(email=f'{prefix}_a{i}@example.com', username=f'{prefix}_a{i}', password='x')
+        b = User.objects.create_user(email=f'{prefix}_b{i}@example.com', username=f'{prefix}_b{i}', password='x')
+        Match.objects.create(user_a=a, user_b=b, status_a=Match.ACCEPTED, status_b=Match.ACCEPTED)
+        pairs.append((a, b))
+    return pairs
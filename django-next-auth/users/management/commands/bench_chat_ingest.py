@@ -0,0 +1,31 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from users.models import ChatMessage
+from ._bench import create_chat_pairs, run_chat_pairs, test_database
+
+
+class Command(BaseCommand):
+    help = 'Measure chat messages/sec through ChatConsumer with direct and write-behind persistence'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=5, help='Concurrent conversations')
+        parser.add_argument('--messages', type=int, default=200, help='Messages sent per conversation')
+
+    def handle(self, *args, **options):
+        from ApiRoot.asgi import application
+
+        with test_database():
+            pairs = create_chat_pairs(options['pairs'])
+
+            self.stdout.write(f'{"mode":>12}  {"messages":>8}  {"seconds":>8}  {"msg/s":>8}  {"persisted":>9}')
+            for mode, write_behind in (('direct', False), ('write-behind', True)):
+                ChatMessage.objects.all().delete()
+                with override_settings(CHAT_WRITE_BEHIND=write_behind):
+                    elapsed = asyncio.run(run_chat_pairs(application, pairs, options['messages']))
+                total = len(pairs) * options['messages']
+                self.stdout.write(
+                    f'{mode:>12}  {total:>8}  {elapsed:>8.2f}  {total / elapsed:>8.0f}  {ChatMessage.objects.count():>9}'
+                )
@@ -0,0 +1,59 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users.cache import potential_matches_cache
+from users.models import MatchCandidate
+from users.views import PotentialMatchesView
+from ._bench import seed_profiles, test_database, time_call
+
+
+class Command(BaseCommand):
+    help = 'Measure latency of the first PotentialMatchesView page as the number of profiles grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--overlapping', type=int, default=50,
+                            help='Number of profiles sharing a subject with the probe user')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        view = PotentialMatchesView.as_view()
+        rng = random.Random(0)
+
+        with test_database():
+            User = get_user_model()
+            probe = User.objects.create_user(email='probe@example.com', username='probe', password='probe')
+            probe.profile.subjects_need_help = ['Probe need']
+            probe.profile.subjects_can_teach = ['Probe teach']
+            probe.profile.is_onboarded = True
+            probe.profile.save()
+
+            # A fixed number of profiles overlap with the probe user; the rest
+            # only share subjects among themselves
+            seed_profiles(options['overlapping'], start=0, subjects=['Probe need', 'Probe teach'],
+                          subjects_per_side=1, rng=rng)
+            seeded = options['overlapping']
+
+            self.stdout.write(f'{"profiles":>10}  {"p50 ms":>8}  {"p95 ms":>8}  {"results":>8}')
+            for size in sorted(options['sizes']):
+                if size > seeded:
+                    seed_profiles(size - seeded, start=seeded, rng=rng)
+                    seeded = size
+                # Seeding bypasses signals, so refresh the probe's candidates
+                MatchCandidate.refresh_for(probe.profile)
+
+                def call():
+                    # Measure the query, not a potential_matches_cache hit
+                    cache.delete(potential_matches_cache.key(probe.id))
+                    request = factory.get('/potential-matches/')
+                    force_authenticate(request, user=probe)
+                    return view(request)
+
+                results = len(call().data['results'])
+                timings = time_call(call, repeat=options['repeat'])
+                self.stdout.write(f'{size:>10}  {timings["p50"]:>8.2f}  {timings["p95"]:>8.2f}  {results:>8}')
@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.renderers import JSONRenderer
+
+from users.models import Profile
+from users.renderers import ORJSONRenderer
+from users.serializers import UserCardSerializer
+from ._bench import SUBJECTS, time_call
+
+
+class Command(BaseCommand):
+    help = 'Measure user card serialization and JSON rendering cost per 1,000 cards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        try:
+            self.run(options['cards'], options['repeat'])
+        finally:
+            teardown_test_environment()
+
+    def run(self, count, repeat):
+        # Unsaved instances keep the database out of the numbers
+        User = get_user_model()
+        rows = []
+        for i in range(count):
+            user = User(id=i + 1, username=f'bench{i}', email=f'bench{i}@example.com')
+            profile = Profile(
+                user=user,
+                school=f'School {i % 50}',
+                subjects_need_help=SUBJECTS[i % 100:i % 100 + 3],
+                subjects_can_teach=SUBJECTS[i % 90:i % 90 + 3],
+                bio='Happy to help with homework.',
+                profile_picture=f'profile_pictures/{i:064x}.jpg' if i % 2 else None,
+                profile_thumbnail=f'profile_pictures/{i:064x}_256.webp' if i % 2 else None,
+            )
+            rows.append((user, profile))
+        request = RequestFactory().get('/api/potential-matches/')
+
+        def per_row():
+            # The hand-built dicts the views used before the shared serializer
+            return [{
+                'user': {
+                    'id': user.id,
+                    'username': user.username,
+                    'profile_picture': request.build_absolute_uri(profile.card_picture.url) if profile.card_picture else None,
+                },
+                'school': profile.school,
+                'subjects_need_help': profile.subjects_need_help,
+                'subjects_can_teach': profile.subjects_can_teach,
+                'bio': profile.bio,
+                'score': 10,
+            } for user, profile in rows]
+
+        def shared():
+            serializer = UserCardSerializer(request)
+            return [serializer.card(user, profile, score=10) for user, profile in rows]
+
+        payload = {'results': shared(), 'next_cursor': None}
+        scale = 1000 / count
+        self.stdout.write(f'{"step":>24}  {"p50 ms":>8}  {"p95 ms":>8}  (per 1,000 cards)')
+        for name, func in (
+            ('per-row build_absolute_uri', per_row),
+            ('UserCardSerializer', shared),
+            ('JSONRenderer', lambda: JSONRenderer().render(payload)),
+            ('ORJSONRenderer', lambda: ORJSONRenderer().render(payload)),
+        ):
+            timings = time_call(func, repeat=repeat)
+            self.stdout.write(f'{name:>24}  {timings["p50"] * scale:>8.2f}  {timings["p95"] * scale:>8.2f}')
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.test.utils import override_settings
+
+from users.models import ChatMessage
+from ._bench import create_chat_pairs, run_chat_pairs, test_database
+
+PROFILES = ('default', 'tuned')
+MODES = ('direct', 'write-behind')
+
+
+class Command(BaseCommand):
+    help = 'Measure chat history read latency on SQLite while ChatConsumer writes, with and without SQLITE_TUNING'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=5, help='Concurrent conversations')
+        parser.add_argument('--messages', type=int, default=200, help='Messages sent per conversation')
+        parser.add_argument('--readers', type=int, default=4, help='Threads reading chat history')
+        parser.add_argument('--profile', choices=PROFILES, help='Run a single profile in this process')
+        parser.add_argument('--mode', choices=MODES, default='direct', help='Persistence mode with --profile')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark only applies to SQLite')
+
+        if options['profile']:
+            self.stdout.write(self.run(options))
+            return
+
+        # Every combination runs in its own process on a new database file:
+        # WAL is a property of the file, and worker threads keep their
+        # connections open across test databases within one process
+        self.stdout.write(
+            f'{"profile":>8}  {"writes":>12}  {"msg/s":>7}  {"reads":>6}  '
+            f'{"p50 ms":>7}  {"p95 ms":>7}  {"max ms":>7}  {"locked":>6}'
+        )
+        for profile in PROFILES:
+            for mode in MODES:
+                result = subprocess.run([
+                    sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_sqlite_readers',
+                    '--profile', profile,
+                    '--mode', mode,
+                    '--pairs', str(options['pairs']),
+                    '--messages', str(options['messages']),
+                    '--readers', str(options['readers']),
+                ], capture_output=True, text=True, check=True)
+                self.stdout.write(result.stdout.rstrip().splitlines()[-1])
+
+    def run(self, options):
+        from ApiRoot.asgi import application
+
+        db_options = dict(settings.SQLITE_TUNING_OPTIONS) if options['profile'] == 'tuned' else {}
+        with tempfile.TemporaryDirectory() as directory:
+            with test_database(os.path.join(directory, 'bench.sqlite3'), db_options):
+                pairs = create_chat_pairs(options['pairs'])
+                with override_settings(CHAT_WRITE_BEHIND=options['mode'] == 'write-behind'):
+                    elapsed, samples, locked = self.measure(application, pairs, options)
+
+        total = len(pairs) * options['messages']
+        samples.sort()
+        p50 = statistics.median(samples) if samples else 0
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))] if samples else 0
+        return (
+            f'{options["profile"]:>8}  {options["mode"]:>12}  {total / elapsed:>7.0f}  {len(samples):>6}  '
+            f'{p50:>7.2f}  {p95:>7.2f}  {max(samples, default=0):>7.2f}  {locked:>6}'
+        )
+
+    def measure(self, application, pairs, options):
+        stop = threading.Event()
+        samples = []
+        locked = []
+
+        def read_history():
+            # What ChatHistoryView does for a page of a conversation
+            try:
+                while not stop.is_set():
+                    for a, b in pairs:
+                        start = time.perf_counter()
+                        try:
+                            list(ChatMessage.objects.filter(
+                                Q(sender=a, receiver=b) | Q(sender=b, receiver=a)
+                            ).order_by('-timestamp', '-id')[:50])
+                        except OperationalError:
+                            locked.append(1)
+                            continue
+                        samples.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+
+        readers = [threading.Thread(target=read_history) for _ in range(options['readers'])]
+        for reader in readers:
+            reader.start()
+        try:
+            elapsed = asyncio.run(run_chat_pairs(application, pairs, options['messages']))
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+        return elapsed, samples, len(locked)
@@ -0,0 +1,62 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.codec import JSONCodec, MsgpackCodec
+from chat.events import message_event
+from users.models import ChatMessage
+from ._bench import time_call
+
+
+class Command(BaseCommand):
+    help = 'Compare chat frame encode/decode cost and bytes on the wire for the JSON and msgpack codecs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=1000)
+        parser.add_argument('--batch', type=int, default=100, help='Messages per batch frame')
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = ['homework', 'tomorrow', 'calculus', 'thanks', 'library', 'can', 'we', 'meet', 'at', 'the', 'essay']
+        # Unsaved messages keep the database out of the numbers
+        frames = []
+        for i in range(options['frames']):
+            sender_id, receiver_id = rng.sample(range(1, 5000), 2)
+            message = ChatMessage(
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                content=' '.join(rng.choices(words, k=rng.randint(2, 30))),
+                timestamp=timezone.now(),
+            )
+            frames.append(dict(message_event(message), type='message'))
+        batches = [
+            {'type': 'batch', 'messages': frames[start:start + options['batch']]}
+            for start in range(0, len(frames), options['batch'])
+        ]
+
+        scale = 1000 / len(frames)
+        self.stdout.write(
+            f'{"codec":>8}  {"shape":>8}  {"encode ms":>10}  {"decode ms":>10}  {"bytes":>9}  (per 1,000 messages)'
+        )
+        for codec in (JSONCodec(), MsgpackCodec()):
+            for shape, payload in (('single', frames), ('batch', batches)):
+                encoded = [self.wire(codec.encode(frame)) for frame in payload]
+                size = sum(len(data) for data in encoded)
+                encode = time_call(lambda: [codec.encode(frame) for frame in payload], repeat=options['repeat'])
+                if isinstance(codec, JSONCodec):
+                    decode = time_call(lambda: [codec.decode(data, None) for data in encoded], repeat=options['repeat'])
+                else:
+                    decode = time_call(lambda: [codec.decode(None, data) for data in encoded], repeat=options['repeat'])
+                name = codec.subprotocol.split('.')[1]
+                self.stdout.write(
+                    f'{name:>8}  {shape:>8}  {encode["p50"] * scale:>10.2f}  {decode["p50"] * scale:>10.2f}'
+                    f'  {size * scale:>9.0f}'
+                )
+
+    def wire(self, encoded):
+        # What goes on the wire: text frames as UTF-8, binary frames as is
+        text_data, bytes_data = encoded
+        return text_data.encode() if text_data is not None else bytes_data
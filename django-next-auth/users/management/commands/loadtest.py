@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.writer import message_writer
+from ._bench import percentiles, seed_conversations, seed_matches, seed_profiles, test_database
+
+# Queries are attributed to the endpoint named in this header. The ASGI
+# test communicators run the app in an empty context, so the tag is read
+# from the scope inside the app rather than set by the caller.
+ENDPOINT_HEADER = b'x-loadtest-endpoint'
+
+_endpoint = ContextVar('loadtest_endpoint', default=None)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        endpoint = _endpoint.get()
+        if endpoint is not None:
+            with self._lock:
+                self.counts[endpoint] += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+def tag_endpoint(application):
+    async def app(scope, receive, send):
+        _endpoint.set(dict(scope.get('headers', [])).get(ENDPOINT_HEADER, b'').decode() or None)
+        return await application(scope, receive, send)
+    return app
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a realistic dataset into a throwaway SQLite database and drive the REST and WebSocket APIs '
+        'concurrently in process, reporting latency percentiles, throughput and queries per endpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--subjects', type=int, default=300, help='Distinct subjects')
+        parser.add_argument('--popularity', type=float, default=1.1,
+                            help='Zipf exponent of subject popularity (0 for uniform)')
+        parser.add_argument('--matches-per-user', type=int, default=5)
+        parser.add_argument('--history', type=int, default=100, help='Messages per mutual match')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent HTTP clients')
+        parser.add_argument('--requests', type=int, default=50, help='Request rounds per HTTP client')
+        parser.add_argument('--sockets', type=int, default=5, help='Concurrent chat conversations')
+        parser.add_argument('--messages', type=int, default=50, help='Messages per chat conversation')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help='Write the results to this file')
+        parser.add_argument('--baseline', help='Fail if p95 or queries/request regress against this results file')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 regression against the baseline (0.25 = 25%%)')
+
+    def handle(self, *args, **options):
+        from ApiRoot.asgi import application
+
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                with test_database(os.path.join(directory, 'loadtest.sqlite3')):
+                    counter.install(None, connection)
+                    mutual = self.seed(options)
+                    tokens = {user.id: str(AccessToken.for_user(user)) for user in get_user_model().objects.all()}
+                    self.stdout.write('Running...')
+                    # Chat clients here send far faster than anyone types
+                    with override_settings(CHAT_RATE_LIMITS=None):
+                        results = asyncio.run(self.drive(tag_endpoint(application), mutual, tokens, options))
+        finally:
+            connection_created.disconnect(counter.install)
+
+        for name, result in results.items():
+            result['queries_per_request'] = counter.counts[name] / max(result['requests'], 1)
+        self.report(results)
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        subjects = [f'Subject {i}' for i in range(options['subjects'])]
+        seed_profiles(options['users'], subjects=subjects, rng=rng, popularity=options['popularity'] or None)
+        call_command('rebuild_match_candidates', stdout=open(os.devnull, 'w'))
+        mutual = seed_matches(options['matches_per_user'], rng=rng)
+        seed_conversations(mutual, options['history'], rng=rng)
+        self.stdout.write(
+            f'Seeded {options["users"]} users, {len(mutual)} mutual matches with '
+            f'{options["history"]} messages each in {time.perf_counter() - started:.1f}s'
+        )
+        if not mutual:
+            raise CommandError('No mutual matches were seeded; raise --users or --matches-per-user')
+        return mutual
+
+    async def drive(self, application, mutual, tokens, options):
+
+        samples = defaultdict(list)
+        requests = defaultdict(int)
+        errors = defaultdict(int)
+        elapsed = {}
+
+        async def request(name, path, user_id):
+            communicator = HttpCommunicator(application, 'GET', path, headers=[
+                (b'host', b'testserver'),
+                (b'authorization', f'Bearer {tokens[user_id]}'.encode()),
+                (ENDPOINT_HEADER, name.encode()),
+            ])
+            requests[name] += 1
+            start = time.perf_counter()
+            try:
+                response = await communicator.get_response(timeout=30)
+            except Exception:
+                errors[name] += 1
+                return
+            finally:
+                # Let the app see the client go away and finish
+                await communicator.send_input({'type': 'http.disconnect'})
+                await communicator.wait(timeout=30)
+            if response['status'] != 200:
+                errors[name] += 1
+                return
+            samples[name].append((time.perf_counter() - start) * 1000)
+
+        async def http_client(client_id):
+            rng = random.Random(options['seed'] * 1000 + client_id)
+            for _ in range(options['requests']):
+                user_id, other_id = rng.choice(mutual)
+                if rng.random() < 0.5:
+                    user_id, other_id = other_id, user_id
+                await request('potential-matches', '/potential-matches/', user_id)
+                await request('matches', '/matches/', user_id)
+                await request('chat-history', f'/chat-history/{other_id}/', user_id)
+                await request('conversations', '/conversations/', user_id)
+                await request('search', '/search/messages/?q=message', user_id)
+
+        async def chat(user_id, other_id):
+            # Round trip from one participant's send to the other's receive
+            headers = [(ENDPOINT_HEADER, b'chat-ws')]
+            sender = WebsocketCommunicator(application, f'/ws/chat/?token={tokens[user_id]}', headers)
+            receiver = WebsocketCommunicator(application, f'/ws/chat/?token={tokens[other_id]}', headers)
+            connected, _ = await sender.connect()
+            await receiver.connect()
+            requests['chat-ws'] += options['messages']
+            if not connected:
+                errors['chat-ws'] += options['messages']
+                return
+            for i in range(options['messages']):
+                start = time.perf_counter()
+                await sender.send_json_to({'message': f'load {i}', 'sender_id': user_id, 'receiver_id': other_id})
+                try:
+                    while True:
+                        event = await receiver.receive_json_from(timeout=30)
+                        # The receiver's socket carries all of its conversations
+                        if event.get('type') == 'message' and event['sender_id'] == user_id:
+                            break
+                except Exception:
+                    errors['chat-ws'] += 1
+                    continue
+                samples['chat-ws'].append((time.perf_counter() - start) * 1000)
+            await sender.disconnect()
+            await receiver.disconnect()
+
+        async def timed(name, coroutines):
+            start = time.perf_counter()
+            await asyncio.gather(*coroutines)
+            elapsed[name] = time.perf_counter() - start
+
+        rng = random.Random(options['seed'])
+        await asyncio.gather(
+            timed('http', [http_client(i) for i in range(options['concurrency'])]),
+            timed('chat-ws', [chat(*pair) for pair in rng.sample(mutual, min(options['sockets'], len(mutual)))]),
+        )
+
+        await message_writer.close()
+
+        results = {}
+        for name in ('potential-matches', 'matches', 'chat-history', 'conversations', 'search', 'chat-ws'):
+            wall = elapsed['chat-ws' if name == 'chat-ws' else 'http']
+            results[name] = {
+                'requests': requests[name],
+                'errors': errors[name],
+                'throughput': len(samples[name]) / wall if wall else 0.0,
+                **percentiles(samples[name]),
+            }
+        return results
+
+    def report(self, results):
+        self.stdout.write(
+            f'{"endpoint":>18}  {"requests":>8}  {"errors":>6}  {"req/s":>7}  '
+            f'{"p50 ms":>7}  {"p95 ms":>7}  {"p99 ms":>7}  {"queries":>7}'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:>18}  {result["requests"]:>8}  {result["errors"]:>6}  {result["throughput"]:>7.1f}  '
+                f'{result["p50"]:>7.2f}  {result["p95"]:>7.2f}  {result["p99"]:>7.2f}  '
+                f'{result["queries_per_request"]:>7.2f}'
+            )
+
+    def compare(self, results, path, tolerance):
+        with open(path) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before:
+                continue
+            if result['p95'] > before['p95'] * (1 + tolerance):
+                regressions.append(f'{name}: p95 {before["p95"]:.2f}ms -> {result["p95"]:.2f}ms')
+            if result['queries_per_request'] > before['queries_per_request'] + 0.01:
+                regressions.append(
+                    f'{name}: queries/request {before["queries_per_request"]:.2f} -> {result["queries_per_request"]:.2f}'
+                )
+            if result['errors'] > before['errors']:
+                regressions.append(f'{name}: errors {before["errors"]} -> {result["errors"]}')
+        if regressions:
+            raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
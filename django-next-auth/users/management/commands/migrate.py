@@ -0,0 +1,40 @@
+from django.core.management.base import CommandError
+from django.core.management.commands.migrate import Command as MigrateCommand
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+
+# Tables that only exist once users.0001_initial has been migrated past
+LATER_TABLES = {'users_subject', 'users_profilesubject', 'users_matchcandidate', 'users_conversation'}
+
+
+class Command(MigrateCommand):
+    """
+    migrate, first adopting databases created before the users app had
+    migrations (migrate --run-syncdb). Their users tables are the schema of
+    users.0001_initial, which is recorded as applied so the later migrations
+    upgrade them; otherwise migrate refuses to run because admin and
+    token_blacklist were applied without it.
+    """
+
+    def handle(self, *args, **options):
+        self.adopt_syncdb_schema(options['database'])
+        super().handle(*args, **options)
+
+    def adopt_syncdb_schema(self, database):
+        connection = connections[database]
+        recorder = MigrationRecorder(connection)
+        if not recorder.has_table() or recorder.migration_qs.filter(app='users').exists():
+            return
+        tables = set(connection.introspection.table_names())
+        if 'users_customuser' not in tables:
+            return
+        if tables & LATER_TABLES:
+            raise CommandError(
+                'The users tables were created with migrate --run-syncdb from a newer schema than '
+                'users.0001_initial; they cannot be adopted automatically'
+            )
+        recorder.record_applied('users', '0001_initial')
+        self.stdout.write(
+            'Recorded users.0001_initial for tables created without migrations. After migrating, run '
+            'rebuild_subject_index, rebuild_match_candidates and rebuild_message_search to index existing data.'
+        )
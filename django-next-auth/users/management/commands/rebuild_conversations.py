@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from users.cache import response_versions
+from users.models import ChatMessage, Conversation
+
+
+class Command(BaseCommand):
+    help = 'Create missing conversation rows and bring their last message up to date from the chat messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # Per direction: the newest message
+        directions = ChatMessage.objects.order_by().values('sender_id', 'receiver_id').annotate(last_id=Max('id'))
+        pairs = defaultdict(dict)
+        for row in directions:
+            pair = Conversation.pair_key(row['sender_id'], row['receiver_id'])
+            pairs[pair][row['receiver_id']] = row
+
+        pair_items = list(pairs.items())
+        created = updated = 0
+        for start in range(0, len(pair_items), batch_size):
+            chunk = pair_items[start:start + batch_size]
+            last_ids = [max(row['last_id'] for row in by_receiver.values()) for _, by_receiver in chunk]
+            last_messages = ChatMessage.objects.only('id', 'sender_id', 'timestamp', 'content').in_bulk(last_ids)
+
+            conversations = []
+            for ((user_low_id, user_high_id), by_receiver), last_id in zip(chunk, last_ids):
+                last_message = last_messages[last_id]
+                conversation = Conversation(
+                    user_low_id=user_low_id,
+                    user_high_id=user_high_id,
+                    last_message_id=last_message.id,
+                    last_sender_id=last_message.sender_id,
+                    last_timestamp=last_message.timestamp,
+                    last_preview=last_message.content[:Conversation.PREVIEW_LENGTH]
+                )
+                # 0004_conversation converted the old read state; a pair still
+                # without a row has none recorded, so its messages count as read
+                for side, receiver_id in (('low', user_low_id), ('high', user_high_id)):
+                    row = by_receiver.get(receiver_id)
+                    if row is not None:
+                        setattr(conversation, f'last_read_{side}', row['last_id'])
+                conversations.append(conversation)
+
+            with transaction.atomic():
+                existing = {
+                    (conversation.user_low_id, conversation.user_high_id): conversation
+                    for conversation in Conversation.objects.filter(
+                        user_low_id__in={conversation.user_low_id for conversation in conversations},
+                        user_high_id__in={conversation.user_high_id for conversation in conversations}
+                    )
+                }
+                # Rows that already exist keep their live read state; only a
+                # missing or older last message is filled in
+                stale = []
+                for conversation in conversations:
+                    current = existing.get((conversation.user_low_id, conversation.user_high_id))
+                    if current is None:
+                        continue
+                    if current.last_message_id is None or current.last_message_id < conversation.last_message_id:
+                        for field in ('last_message_id', 'last_sender_id', 'last_timestamp', 'last_preview'):
+                            setattr(current, field, getattr(conversation, field))
+                        stale.append(current)
+                missing = [
+                    conversation for conversation in conversations
+                    if (conversation.user_low_id, conversation.user_high_id) not in existing
+                ]
+                Conversation.objects.bulk_create(missing, ignore_conflicts=True)
+                Conversation.objects.bulk_update(
+                    stale, ['last_message_id', 'last_sender_id', 'last_timestamp', 'last_preview']
+                )
+                # Both sides' conversation lists change once this commits
+                response_versions.bump(
+                    user_id
+                    for conversation in missing + stale
+                    for user_id in (conversation.user_low_id, conversation.user_high_id)
+                )
+            created += len(missing)
+            updated += len(stale)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} conversations and updated the last message of {updated}'
+        ))
+
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from users.cache import potential_matches_cache, response_versions
+from users.models import Match, MatchCandidate, Profile
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed match candidate table from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        profiles = Profile.objects.filter(is_onboarded=True).select_related('user')
+
+        count = 0
+        with transaction.atomic():
+            # Everyone with a feed before or after the rebuild
+            affected = set(MatchCandidate.objects.order_by().values_list('user_id', flat=True).distinct())
+            MatchCandidate.objects.all().delete()
+
+            # Each profile only builds its own side; the other side is built
+            # when the loop reaches the candidate's profile
+            batch = []
+            for profile in profiles.iterator(chunk_size=batch_size):
+                batch.extend(MatchCandidate.build_for(profile, now=now))
+                if len(batch) >= batch_size:
+                    MatchCandidate.objects.bulk_create(batch, batch_size=batch_size)
+                    affected.update(row.user_id for row in batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                MatchCandidate.objects.bulk_create(batch, batch_size=batch_size)
+                affected.update(row.user_id for row in batch)
+                count += len(batch)
+
+            MatchCandidate.objects.filter(Exists(Match.objects.filter(
+                Q(user_a_id=OuterRef('user_id'), user_b_id=OuterRef('candidate_id')) |
+                Q(user_a_id=OuterRef('candidate_id'), user_b_id=OuterRef('user_id'))
+            ))).update(has_match=True)
+
+            # Once committed, every affected feed is rebuilt on its next request
+            affected = list(affected)
+            for start in range(0, len(affected), batch_size):
+                response_versions.bump(affected[start:start + batch_size])
+                potential_matches_cache.invalidate(affected[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(f'Built {count} match candidates'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Greatest, Least
+from users.models import Match
+
+
+class Command(BaseCommand):
+    help = 'Fill in the canonical pair key on matches created before it existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pending = Match.objects.filter(pair_low__isnull=True)
+        # Before the pair key a pair could be stored in both directions; the
+        # oldest row keeps the key and later ones are left for review
+        older_twin = Exists(Match.objects.filter(
+            user_a_id=OuterRef('user_b_id'),
+            user_b_id=OuterRef('user_a_id'),
+            id__lt=OuterRef('id')
+        ))
+
+        last_id = 0
+        count = 0
+        while True:
+            window = list(pending.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not window:
+                break
+            count += pending.filter(id__in=window).exclude(older_twin).update(
+                pair_low=Least('user_a_id', 'user_b_id'),
+                pair_high=Greatest('user_a_id', 'user_b_id')
+            )
+            last_id = window[-1]
+
+        duplicates = list(pending.values_list('id', 'user_a_id', 'user_b_id'))
+        for match_id, user_a_id, user_b_id in duplicates:
+            self.stdout.write(self.style.WARNING(
+                f'Match {match_id} ({user_a_id} -> {user_b_id}) duplicates an older match of the same pair; left without a pair key'
+            ))
+        self.stdout.write(self.style.SUCCESS(f'Set the pair key on {count} matches'))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from users.models import ChatMessage
+from users import search
+
+
+class Command(BaseCommand):
+    help = 'Add chat messages missing from the search index, in chunks by message id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Index every message into a new index and swap it in; search keeps working meanwhile'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if search.search_connection(write=True).vendor != 'sqlite':
+            if options['rebuild']:
+                search.reindex()
+            self.stdout.write(self.style.SUCCESS('The database maintains the search index itself'))
+            return
+
+        # A rebuild interrupted part way resumes into the same table
+        table = search.REBUILD_TABLE if options['rebuild'] else search.FTS_TABLE
+        search.create_search_index(table=table)
+
+        messages = ChatMessage.objects.only('id', 'content', 'sender_id', 'receiver_id').order_by('id')
+        last_id = 0
+        count = 0
+        while True:
+            batch = list(messages.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            # Messages saved since the index existed are already in it
+            indexed = search.indexed_ids(batch[0].id, batch[-1].id, table)
+            missing = [message for message in batch if message.id not in indexed]
+            # One transaction per chunk, so an interrupted run keeps its work
+            with transaction.atomic():
+                search.index_messages(missing, table)
+            last_id = batch[-1].id
+            count += len(missing)
+            self.stdout.write(f'Indexed {count} messages')
+
+        if options['rebuild']:
+            count += search.swap_search_index(table)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} messages'))
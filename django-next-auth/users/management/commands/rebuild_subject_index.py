@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from users.cache import potential_matches_cache, response_versions
+from users.models import MatchCandidate, Profile
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the subject index from the JSON subject lists on every profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        profiles = Profile.objects.only('id', 'subjects_need_help', 'subjects_can_teach')
+
+        count = 0
+        changed = []
+        for profile in profiles.iterator(chunk_size=batch_size):
+            if profile.sync_subjects():
+                changed.append(profile.id)
+            count += 1
+
+        # Feeds are read from the candidate table, so a changed index only
+        # reaches them once the candidates of its profiles are recomputed,
+        # as saving the profile would have done
+        affected = set()
+        for start in range(0, len(changed), batch_size):
+            for profile in Profile.objects.filter(id__in=changed[start:start + batch_size]).select_related('user'):
+                affected |= MatchCandidate.refresh_for(profile)
+
+        affected = list(affected)
+        for start in range(0, len(affected), batch_size):
+            response_versions.bump(affected[start:start + batch_size])
+            potential_matches_cache.invalidate(affected[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed subjects for {count} profiles, {len(changed)} changed; refreshed the feeds of {len(affected)} users'
+        ))
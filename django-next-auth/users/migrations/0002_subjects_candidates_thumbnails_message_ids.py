@@ -0,0 +1,73 @@
+# Generated by Django 5.1.4 on 2026-10-18 00:54
+
+import django.db.models.deletion
+import django.utils.timezone
+import users.ids
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Subject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProfileSubject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('need', 'Needs help with'), ('teach', 'Can teach')], max_length=5)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subject_links', to='users.profile')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='profile_links', to='users.subject')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['subject', 'kind', 'profile'], name='users_profi_subject_c8db96_idx')],
+                'unique_together': {('profile', 'subject', 'kind')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MatchCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('can_help_with', models.JSONField(default=list)),
+                ('can_get_help_with', models.JSONField(default=list)),
+                ('score', models.IntegerField(default=0)),
+                ('has_match', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('candidate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='match_candidates', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'has_match', '-score', '-candidate'], name='users_match_user_id_879ac6_idx')],
+                'unique_together': {('user', 'candidate')},
+            },
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='profile_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='profile_pictures/'),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='id',
+            field=models.BigIntegerField(default=users.ids.generate_message_id, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['sender', 'receiver', 'timestamp'], name='users_chatm_sender__543758_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Greatest, Least
+
+
+def fill_pair_keys(apps, schema_editor):
+    Match = apps.get_model('users', 'Match')
+    # A pair stored in both directions keeps the key on its oldest row only;
+    # the others stay null (rebuild_match_pairs lists them)
+    older_twin = Exists(Match.objects.filter(
+        user_a_id=OuterRef('user_b_id'),
+        user_b_id=OuterRef('user_a_id'),
+        id__lt=OuterRef('id')
+    ))
+    Match.objects.using(schema_editor.connection.alias).exclude(older_twin).update(
+        pair_low=Least('user_a_id', 'user_b_id'),
+        pair_high=Greatest('user_a_id', 'user_b_id')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_subjects_candidates_thumbnails_message_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='pair_low',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='pair_high',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_pair_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='match',
+            constraint=models.UniqueConstraint(fields=('pair_low', 'pair_high'), name='unique_match_pair'),
+        ),
+    ]
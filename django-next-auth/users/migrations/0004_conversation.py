@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+PREVIEW_LENGTH = 140
+BATCH_SIZE = 1000
+
+
+def build_conversations(apps, schema_editor):
+    """
+    One Conversation per pair that has messages: the last message, and each
+    side's read cursor (its newest read message) and unread count from the
+    is_read column this migration then drops.
+    """
+    ChatMessage = apps.get_model('users', 'ChatMessage')
+    Conversation = apps.get_model('users', 'Conversation')
+    database = schema_editor.connection.alias
+
+    directions = ChatMessage.objects.using(database).order_by().values('sender_id', 'receiver_id').annotate(
+        last_id=Max('id'),
+        last_read_id=Max('id', filter=Q(is_read=True)),
+        unread=Count('id', filter=Q(is_read=False))
+    )
+    pairs = defaultdict(dict)
+    for row in directions:
+        pair = (min(row['sender_id'], row['receiver_id']), max(row['sender_id'], row['receiver_id']))
+        pairs[pair][row['receiver_id']] = row
+
+    pair_items = list(pairs.items())
+    for start in range(0, len(pair_items), BATCH_SIZE):
+        chunk = pair_items[start:start + BATCH_SIZE]
+        last_ids = [max(row['last_id'] for row in by_receiver.values()) for _, by_receiver in chunk]
+        last_messages = ChatMessage.objects.using(database).in_bulk(last_ids)
+        conversations = []
+        for ((user_low_id, user_high_id), by_receiver), last_id in zip(chunk, last_ids):
+            last_message = last_messages[last_id]
+            conversation = Conversation(
+                user_low_id=user_low_id,
+                user_high_id=user_high_id,
+                last_message_id=last_message.id,
+                last_sender_id=last_message.sender_id,
+                last_timestamp=last_message.timestamp,
+                last_preview=last_message.content[:PREVIEW_LENGTH]
+            )
+            for side, receiver_id in (('low', user_low_id), ('high', user_high_id)):
+                row = by_receiver.get(receiver_id)
+                if row is not None:
+                    setattr(conversation, f'last_read_{side}', row['last_read_id'] or 0)
+                    setattr(conversation, f'unread_{side}', row['unread'])
+            conversations.append(conversation)
+        Conversation.objects.using(database).bulk_create(conversations)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_match_pair_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_low', models.BigIntegerField(default=0)),
+                ('last_read_high', models.BigIntegerField(default=0)),
+                ('unread_low', models.PositiveIntegerField(default=0)),
+                ('unread_high', models.PositiveIntegerField(default=0)),
+                ('last_message_id', models.BigIntegerField(null=True)),
+                ('last_sender_id', models.BigIntegerField(null=True)),
+                ('last_timestamp', models.DateTimeField(null=True)),
+                ('last_preview', models.CharField(blank=True, default='', max_length=140)),
+                ('user_high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['user_low', '-last_message_id'], name='users_conve_user_lo_d2783d_idx'),
+                    models.Index(fields=['user_high', '-last_message_id'], name='users_conve_user_hi_13819d_idx'),
+                ],
+                'unique_together': {('user_low', 'user_high')},
+            },
+        ),
+        migrations.RunPython(build_conversations, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='chatmessage',
+            name='is_read',
+        ),
+    ]
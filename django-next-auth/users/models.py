@@ -1,9 +1,21 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.db.models import Q
+from django.db.models import Q, F, Case, When, Value, Count, Subquery
+from django.db.models.functions import Coalesce
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+from datetime import timedelta
+from functools import reduce
+from collections import defaultdict
+import operator
+from .cache import user_cache, mutual_match_cache, response_versions, potential_matches_cache
+from .ids import earlier_message_id, generate_message_id
+from .search import index_messages
+from chat.events import match_event, notify_users
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -30,6 +42,14 @@ class CustomUser(AbstractUser):
 
     objects = CustomUserManager()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Usernames are shown on other users' cards
+        if 'username' in field_names:
+            instance._loaded_username = instance.username
+        return instance
+
     def save(self, *args, **kwargs):
         self.email = self.email.lower()
         super().save(*args, **kwargs)
@@ -49,6 +69,8 @@ class Profile(models.Model):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=STUDENT)
     school = models.CharField(max_length=200, blank=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    # Fixed-size thumbnail used wherever a user is shown in a list
+    profile_thumbnail = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
     subjects_need_help = models.JSONField(default=list, blank=True)
     subjects_can_teach = models.JSONField(default=list, blank=True)
     bio = models.TextField(max_length=500, blank=True)
@@ -57,14 +79,307 @@ class Profile(models.Model):
     def __str__(self):
         return f"{self.user.email}'s profile"
 
+    @property
+    def card_picture(self):
+        # Pictures uploaded before thumbnails existed fall back to the original
+        return self.profile_thumbnail or self.profile_picture
+
+    MATCHING_FIELDS = ('subjects_need_help', 'subjects_can_teach', 'school', 'is_onboarded')
+    # Fields that show up in this user's or anyone else's API responses
+    CARD_FIELDS = (
+        'role', 'school', 'profile_picture', 'profile_thumbnail',
+        'subjects_need_help', 'subjects_can_teach', 'bio', 'is_onboarded',
+    )
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the subject index and match candidates were built from
+        # so saves that don't touch them (e.g. every user save) can skip the
+        # refresh
+        if all(field in field_names for field in cls.MATCHING_FIELDS):
+            instance._matching_state = instance.matching_state()
+        if all(field in field_names for field in cls.CARD_FIELDS):
+            instance._card_state = instance.card_state()
+        return instance
+
+    def subject_state(self):
+        return (
+            frozenset(str(name) for name in self.subjects_need_help or []),
+            frozenset(str(name) for name in self.subjects_can_teach or []),
+        )
+
+    def matching_state(self):
+        return self.subject_state() + (self.school, self.is_onboarded)
+
+    def card_state(self):
+        return tuple(str(getattr(self, field)) for field in self.CARD_FIELDS)
+
+    def viewer_ids(self):
+        # The user plus everyone whose matches, match requests or feed show
+        # this profile's card
+        user_id = self.user_id
+        matched = Match.objects.filter(
+            Q(user_a_id=user_id) | Q(user_b_id=user_id)
+        ).values_list('user_a_id', 'user_b_id')
+        viewers = {other for pair in matched for other in pair}
+        viewers.update(MatchCandidate.objects.filter(candidate_id=user_id).values_list('user_id', flat=True))
+        viewers.add(user_id)
+        return viewers
+
+    def sync_subjects(self):
+        # Mirror the JSON subject lists into the ProfileSubject index. Returns
+        # whether any link was added or removed
+        need_help, can_teach = self.subject_state()
+        wanted = {(name, ProfileSubject.NEED) for name in need_help}
+        wanted |= {(name, ProfileSubject.TEACH) for name in can_teach}
+        names = need_help | can_teach
+
+        with transaction.atomic():
+            if names:
+                Subject.objects.bulk_create(
+                    [Subject(name=name) for name in names],
+                    ignore_conflicts=True
+                )
+            subject_ids = dict(Subject.objects.filter(name__in=names).values_list('name', 'id'))
+            wanted_links = {(subject_ids[name], kind) for name, kind in wanted}
+            existing_links = set(self.subject_links.values_list('subject_id', 'kind'))
+
+            stale_links = existing_links - wanted_links
+            if stale_links:
+                self.subject_links.filter(reduce(operator.or_, [
+                    Q(subject_id=subject_id, kind=kind) for subject_id, kind in stale_links
+                ])).delete()
+
+            new_links = wanted_links - existing_links
+            if new_links:
+                ProfileSubject.objects.bulk_create([
+                    ProfileSubject(profile=self, subject_id=subject_id, kind=kind)
+                    for subject_id, kind in new_links
+                ])
+        return bool(stale_links or new_links)
+
+class Subject(models.Model):
+    name = models.CharField(max_length=200, unique=True)
+
+    def __str__(self):
+        return self.name
+
+class ProfileSubject(models.Model):
+    NEED = 'need'
+    TEACH = 'teach'
+
+    KIND_CHOICES = [
+        (NEED, 'Needs help with'),
+        (TEACH, 'Can teach'),
+    ]
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='subject_links')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='profile_links')
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+
+    class Meta:
+        unique_together = ('profile', 'subject', 'kind')
+        indexes = [
+            # Lookup direction for candidate search: subject -> profiles
+            models.Index(fields=['subject', 'kind', 'profile']),
+        ]
+
+    @classmethod
+    def overlapping_links(cls, profile, exclude_user_ids=()):
+        # Index rows of onboarded profiles that need what `profile` teaches or
+        # teach what it needs, found with one join over the subject index
+        own_links = cls.objects.filter(profile=profile)
+        teach_ids = own_links.filter(kind=cls.TEACH).values('subject_id')
+        need_ids = own_links.filter(kind=cls.NEED).values('subject_id')
+
+        return cls.objects.filter(
+            Q(kind=cls.NEED, subject_id__in=teach_ids) |
+            Q(kind=cls.TEACH, subject_id__in=need_ids),
+            profile__is_onboarded=True
+        ).exclude(
+            profile_id=profile.id
+        ).exclude(
+            profile__user_id__in=exclude_user_ids
+        )
+
+    @classmethod
+    def overlaps_for(cls, profile, exclude_user_ids=(), profile_ids=None):
+        """
+        Return {profile_id: (can_help_with, can_get_help_with)} for every
+        onboarded profile sharing a subject with `profile`, optionally limited
+        to `profile_ids`.
+        """
+        links = cls.overlapping_links(profile, exclude_user_ids)
+        if profile_ids is not None:
+            links = links.filter(profile_id__in=profile_ids)
+
+        overlaps = {}
+        for profile_id, name, kind in links.values_list('profile_id', 'subject__name', 'kind'):
+            can_help_with, can_get_help_with = overlaps.setdefault(profile_id, ([], []))
+            # They need it and we teach it -> we can help them
+            if kind == cls.NEED:
+                can_help_with.append(name)
+            else:
+                can_get_help_with.append(name)
+        return overlaps
+
+class MatchCandidate(models.Model):
+    # Precomputed potential-match feed. Each overlapping pair of onboarded
+    # users is stored in both directions and refreshed only for the users a
+    # profile or Match change affects
+
+    # Relevance weights
+    OVERLAP_WEIGHT = 10
+    SCHOOL_BONUS = 5
+    RECENT_ACTIVITY_BONUS = ((timedelta(days=7), 3), (timedelta(days=30), 1))
+
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='match_candidates')
+    candidate = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='+')
+    # Subjects `user` can teach `candidate`, and subjects `candidate` can teach `user`
+    can_help_with = models.JSONField(default=list)
+    can_get_help_with = models.JSONField(default=list)
+    score = models.IntegerField(default=0)
+    # Any Match row between the pair, whatever its status, hides it from the feed
+    has_match = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'candidate')
+        indexes = [
+            models.Index(fields=['user', 'has_match', '-score', '-candidate']),
+        ]
+
+    @classmethod
+    def compute_score(cls, overlap_count, same_school, last_login, now):
+        score = overlap_count * cls.OVERLAP_WEIGHT
+        if same_school:
+            score += cls.SCHOOL_BONUS
+        if last_login:
+            for age, bonus in cls.RECENT_ACTIVITY_BONUS:
+                if last_login >= now - age:
+                    score += bonus
+                    break
+        return score
+
+    @classmethod
+    def build_for(cls, profile, mirrored=False, now=None):
+        """
+        Build (unsaved) candidate rows for `profile` from the subject index.
+        With `mirrored`, the rows seen from each candidate's side are built
+        as well.
+        """
+        now = now or timezone.now()
+        if not profile.is_onboarded:
+            return []
+
+        overlaps = ProfileSubject.overlaps_for(profile)
+        others = Profile.objects.filter(id__in=overlaps.keys()).values_list(
+            'id', 'user_id', 'school', 'user__last_login'
+        )
+
+        rows = []
+        for profile_id, user_id, school, last_login in others:
+            can_help_with, can_get_help_with = overlaps[profile_id]
+            overlap_count = len(can_help_with) + len(can_get_help_with)
+            same_school = bool(profile.school) and school == profile.school
+            rows.append(cls(
+                user_id=profile.user_id,
+                candidate_id=user_id,
+                can_help_with=can_help_with,
+                can_get_help_with=can_get_help_with,
+                score=cls.compute_score(overlap_count, same_school, last_login, now)
+            ))
+            if mirrored:
+                rows.append(cls(
+                    user_id=user_id,
+                    candidate_id=profile.user_id,
+                    can_help_with=can_get_help_with,
+                    can_get_help_with=can_help_with,
+                    score=cls.compute_score(overlap_count, same_school, profile.user.last_login, now)
+                ))
+        return rows
+
+    @classmethod
+    def refresh_for(cls, profile):
+        # Recompute every pair involving `profile` in both directions. Returns
+        # the ids of the users whose feed gained, lost or changed a row
+        user_id = profile.user_id
+        matched = Match.objects.filter(
+            Q(user_a_id=user_id) | Q(user_b_id=user_id)
+        ).values_list('user_a_id', 'user_b_id')
+        matched_users = {other for pair in matched for other in pair} - {user_id}
+
+        rows = cls.build_for(profile, mirrored=True)
+        for row in rows:
+            row.has_match = (row.candidate_id if row.user_id == user_id else row.user_id) in matched_users
+
+        with transaction.atomic():
+            affected = set(cls.objects.filter(candidate_id=user_id).values_list('user_id', flat=True))
+            cls.objects.filter(Q(user_id=user_id) | Q(candidate_id=user_id)).delete()
+            cls.objects.bulk_create(rows)
+        affected.update(row.user_id for row in rows)
+        affected.add(user_id)
+        return affected
+
+    @classmethod
+    def set_has_match(cls, user_a_id, user_b_id, has_match):
+        cls.objects.filter(
+            Q(user_id=user_a_id, candidate_id=user_b_id) |
+            Q(user_id=user_b_id, candidate_id=user_a_id)
+        ).update(has_match=has_match)
+
 @receiver(post_save, sender=get_user_model())
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
 @receiver(post_save, sender=get_user_model())
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+@receiver(post_delete, sender=get_user_model())
+def invalidate_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id)
+
+@receiver(post_save, sender=get_user_model())
+def bump_username_response_versions(sender, instance, created, **kwargs):
+    if created or kwargs.get('raw'):
+        return
+    if getattr(instance, '_loaded_username', instance.username) != instance.username:
+        response_versions.bump(instance.profile.viewer_ids())
+    instance._loaded_username = instance.username
+
+@receiver(post_save, sender=Profile)
+def refresh_profile_matching(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    previous = getattr(instance, '_matching_state', None)
+    state = instance.matching_state()
+    if created and not any(state[:2]) and not instance.is_onboarded:
+        instance._matching_state = state
+        return
+    if previous == state:
+        return
+
+    if previous is None or previous[:2] != state[:2]:
+        instance.sync_subjects()
+    # Everyone sharing a subject gets a stale feed refreshed in the
+    # background; the user's own feed is rebuilt on their next request
+    response_versions.bump(MatchCandidate.refresh_for(instance))
+    potential_matches_cache.invalidate((instance.user_id,))
+    instance._matching_state = state
+
+@receiver(post_save, sender=Profile)
+def bump_profile_response_versions(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    state = instance.card_state()
+    if getattr(instance, '_card_state', None) != state:
+        response_versions.bump(instance.viewer_ids())
+    instance._card_state = state
 
 class Match(models.Model):
     PENDING = 'pending'
@@ -83,48 +398,301 @@ class Match(models.Model):
     status_b = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Canonical (smaller id, larger id) key of the pair, so either direction
+    # is found with a single indexed equality lookup. Set on save; null only
+    # on rows from before it existed until rebuild_match_pairs fills them
+    pair_low = models.PositiveBigIntegerField(null=True, editable=False)
+    pair_high = models.PositiveBigIntegerField(null=True, editable=False)
 
     class Meta:
         unique_together = ('user_a', 'user_b')
+        constraints = [
+            models.UniqueConstraint(fields=['pair_low', 'pair_high'], name='unique_match_pair'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.pair_low, self.pair_high = self.pair_key(self.user_a_id, self.user_b_id)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def pair_key(user_a_id, user_b_id):
+        return min(user_a_id, user_b_id), max(user_a_id, user_b_id)
+
+    @classmethod
+    def for_pair(cls, user_a_id, user_b_id):
+        pair_low, pair_high = cls.pair_key(user_a_id, user_b_id)
+        return cls.objects.filter(pair_low=pair_low, pair_high=pair_high)
 
     @classmethod
     def create_or_update(cls, user_a, user_b, status):
         # Try to find existing match in either direction
-        match = cls.objects.filter(
-            (Q(user_a=user_a) & Q(user_b=user_b)) |
-            (Q(user_a=user_b) & Q(user_b=user_a))
-        ).first()
-        
-        if match:
-            # Update existing match
-            if match.user_a == user_a:
-                match.status_a = status
-            else:
-                match.status_b = status
-            match.save()
+        match = cls.for_pair(user_a.id, user_b.id).first()
+
+        if match is None:
+            try:
+                # In a savepoint, so losing the race below only rolls back
+                # this insert and not the caller's transaction
+                with transaction.atomic():
+                    return cls.objects.create(
+                        user_a=user_a,
+                        user_b=user_b,
+                        status_a=status,
+                        status_b=cls.PENDING
+                    )
+            except IntegrityError:
+                # Both users swiped at once and the other insert won the
+                # pair key: update the row it created instead
+                match = cls.for_pair(user_a.id, user_b.id).get()
+
+        # Update existing match
+        if match.user_a_id == user_a.id:
+            match.status_a = status
         else:
-            # Create new match
-            match = cls.objects.create(
-                user_a=user_a,
-                user_b=user_b,
-                status_a=status,
-                status_b=cls.PENDING
-            )
+            match.status_b = status
+        match.save()
         return match
 
     @property
     def is_mutual_match(self):
         return self.status_a == self.ACCEPTED and self.status_b == self.ACCEPTED
 
+    @classmethod
+    def mutual_partner_ids(cls, user_id):
+        pairs = cls.objects.filter(
+            Q(pair_low=user_id) | Q(pair_high=user_id),
+            status_a=cls.ACCEPTED,
+            status_b=cls.ACCEPTED
+        ).values_list('pair_low', 'pair_high')
+        return {pair_high if pair_low == user_id else pair_low for pair_low, pair_high in pairs}
+
+@receiver(post_save, sender=Match)
+def hide_matched_candidates(sender, instance, created, **kwargs):
+    if created and not kwargs.get('raw'):
+        MatchCandidate.set_has_match(instance.user_a_id, instance.user_b_id, True)
+        potential_matches_cache.invalidate((instance.user_a_id, instance.user_b_id))
+
+@receiver(post_delete, sender=Match)
+def restore_matched_candidates(sender, instance, **kwargs):
+    MatchCandidate.set_has_match(instance.user_a_id, instance.user_b_id, False)
+    potential_matches_cache.invalidate((instance.user_a_id, instance.user_b_id))
+
+# Cached once committed: set before, a rolled back save would leave the
+# cache disagreeing with the database, and readers could see it first
+
+@receiver(post_save, sender=Match)
+def update_cached_mutual_match(sender, instance, **kwargs):
+    user_a_id, user_b_id, is_mutual = instance.user_a_id, instance.user_b_id, instance.is_mutual_match
+    transaction.on_commit(lambda: mutual_match_cache.set(user_a_id, user_b_id, is_mutual))
+
+@receiver(post_delete, sender=Match)
+def clear_cached_mutual_match(sender, instance, **kwargs):
+    user_a_id, user_b_id = instance.user_a_id, instance.user_b_id
+    transaction.on_commit(lambda: mutual_match_cache.set(user_a_id, user_b_id, False))
+
+@receiver(post_save, sender=Match)
+@receiver(post_delete, sender=Match)
+def bump_match_response_versions(sender, instance, **kwargs):
+    response_versions.bump((instance.user_a_id, instance.user_b_id))
+
+@receiver(post_save, sender=Match)
+def push_match_saved(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    event = 'matched' if instance.is_mutual_match else 'requested' if created else 'updated'
+    payload = match_event(instance, event)
+    transaction.on_commit(lambda: notify_users(payload['user_ids'], payload))
+
+@receiver(post_delete, sender=Match)
+def push_match_deleted(sender, instance, **kwargs):
+    payload = match_event(instance, 'unmatched')
+    transaction.on_commit(lambda: notify_users(payload['user_ids'], payload))
+
 class ChatMessage(models.Model):
+    # Ids and timestamps are assigned when the instance is built rather than
+    # by the database, so the chat consumer can broadcast a message before
+    # its row is written
+    id = models.BigIntegerField(primary_key=True, default=generate_message_id, editable=False)
     sender = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='sent_messages')
     receiver = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='received_messages')
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Conversation range scans: one (sender, receiver) direction,
+            # ordered by time
+            models.Index(fields=['sender', 'receiver', 'timestamp']),
+        ]
 
     def __str__(self):
-        return f"Message from {self.sender.username} to {self.receiver.username}"
\ No newline at end of file
+        return f"Message from {self.sender.username} to {self.receiver.username}"
+
+    @staticmethod
+    def after(messages, after_id, limit):
+        """
+        Up to `limit` of the oldest of `messages` after `after_id`, preceded
+        by those of the CHAT_SYNC_OVERLAP_MS before it, in id order. Ids
+        are handed out before their rows commit, so a message with a smaller
+        id than one a client has already seen can still turn up; clients
+        skip the resent ones they have.
+        """
+        late = messages.filter(
+            id__gt=earlier_message_id(after_id, settings.CHAT_SYNC_OVERLAP_MS),
+            id__lte=after_id
+        )
+        late = list(late.order_by('-id')[:limit])
+        late.reverse()
+        return late + list(messages.filter(id__gt=after_id).order_by('id')[:limit])
+
+class Conversation(models.Model):
+    PREVIEW_LENGTH = 140
+
+    # Per user pair read state: each side's read cursor (the last message id
+    # it has read) and a maintained count of messages waiting for it, so
+    # reads never rewrite message rows and unread counts never scan them
+    user_low = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='+')
+    last_read_low = models.BigIntegerField(default=0)
+    last_read_high = models.BigIntegerField(default=0)
+    unread_low = models.PositiveIntegerField(default=0)
+    unread_high = models.PositiveIntegerField(default=0)
+    # The latest message, for conversation lists. Message ids grow with
+    # time, so last_message_id also orders conversations by recency
+    last_message_id = models.BigIntegerField(null=True)
+    last_sender_id = models.BigIntegerField(null=True)
+    last_timestamp = models.DateTimeField(null=True)
+    last_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+
+    class Meta:
+        unique_together = ('user_low', 'user_high')
+        indexes = [
+            # A user's conversations by recency, one index per side
+            models.Index(fields=['user_low', '-last_message_id']),
+            models.Index(fields=['user_high', '-last_message_id']),
+        ]
+
+    @staticmethod
+    def pair_key(user_a_id, user_b_id):
+        return min(user_a_id, user_b_id), max(user_a_id, user_b_id)
+
+    @classmethod
+    def for_pair(cls, user_a_id, user_b_id):
+        user_low_id, user_high_id = cls.pair_key(user_a_id, user_b_id)
+        return cls.objects.filter(user_low_id=user_low_id, user_high_id=user_high_id)
+
+    @classmethod
+    def for_user(cls, user_id):
+        return cls.objects.filter(Q(user_low_id=user_id) | Q(user_high_id=user_id))
+
+    def side(self, user_id):
+        return 'low' if user_id == self.user_low_id else 'high'
+
+    def other_user_id(self, user_id):
+        return self.user_high_id if user_id == self.user_low_id else self.user_low_id
+
+    def last_read(self, user_id):
+        return getattr(self, f'last_read_{self.side(user_id)}')
+
+    def unread(self, user_id):
+        return getattr(self, f'unread_{self.side(user_id)}')
+
+    def is_read(self, message):
+        # A message is read once the receiver's cursor has reached it
+        return message.id <= self.last_read(message.receiver_id)
+
+    @classmethod
+    def record_messages(cls, messages):
+        # Count newly inserted messages against their receivers, move each
+        # conversation's last message forward and add the messages to the
+        # search index; call in the same transaction as the insert. One
+        # UPDATE per conversation.
+        by_pair = defaultdict(list)
+        for message in messages:
+            by_pair[cls.pair_key(message.sender_id, message.receiver_id)].append(message)
+        if not by_pair:
+            return
+        cls.objects.bulk_create([
+            cls(user_low_id=user_low_id, user_high_id=user_high_id)
+            for user_low_id, user_high_id in by_pair
+        ], ignore_conflicts=True)
+        for (user_low_id, user_high_id), pair_messages in by_pair.items():
+            changes = {}
+            for side, receiver_id in (('low', user_low_id), ('high', user_high_id)):
+                message_ids = [message.id for message in pair_messages if message.receiver_id == receiver_id]
+                if not message_ids:
+                    continue
+                # Messages persisted late (write-behind) may already be behind
+                # the receiver's cursor; only count the ones past it
+                newly_unread = reduce(operator.add, [
+                    Case(When(**{f'last_read_{side}__lt': message_id}, then=Value(1)), default=Value(0))
+                    for message_id in message_ids
+                ])
+                changes[f'unread_{side}'] = F(f'unread_{side}') + newly_unread
+            # Late messages don't replace a newer last message either
+            latest = max(pair_messages, key=lambda message: message.id)
+            is_newer = Q(last_message_id__isnull=True) | Q(last_message_id__lt=latest.id)
+            for field, value in (
+                ('last_message_id', latest.id),
+                ('last_sender_id', latest.sender_id),
+                ('last_timestamp', latest.timestamp),
+                ('last_preview', latest.content[:cls.PREVIEW_LENGTH]),
+            ):
+                changes[field] = Case(When(is_newer, then=Value(value)), default=F(field), output_field=cls._meta.get_field(field))
+            cls.objects.filter(user_low_id=user_low_id, user_high_id=user_high_id).update(**changes)
+        index_messages(messages)
+        # Unread counts are part of the receivers' matches list, and the last
+        # message of both sides' conversation lists
+        response_versions.bump(user_id for pair in by_pair for user_id in pair)
+
+    @classmethod
+    def recent_for_user(cls, user_id, before_message_id=None, limit=20):
+        """
+        A page of the user's conversations with at least one message, most
+        recent first, in a single query: one index range per side, merged.
+        Where the database allows it (not SQLite) each side is also cut to
+        `limit` rows by reading its index in order.
+        """
+        database = router.db_for_read(cls)
+        arms = []
+        for column in ('user_low_id', 'user_high_id'):
+            arm = cls.objects.filter(**{column: user_id}, last_message_id__isnull=False)
+            if before_message_id is not None:
+                arm = arm.filter(last_message_id__lt=before_message_id)
+            if connections[database].features.supports_slicing_ordering_in_compound:
+                arm = arm.order_by('-last_message_id')[:limit]
+            arms.append(arm)
+        return list(arms[0].union(arms[1], all=True).order_by('-last_message_id')[:limit])
+
+    @classmethod
+    def mark_read(cls, reader_id, other_id, last_read_id):
+        """
+        Advance `reader_id`'s cursor to `last_read_id`, clamped to the newest
+        message `other_id` has actually sent them. Returns the updated
+        conversation, or None when the cursor was already there so callers
+        can skip notifying anyone.
+        """
+        user_low_id, user_high_id = cls.pair_key(reader_id, other_id)
+        side = 'low' if reader_id == user_low_id else 'high'
+        incoming = ChatMessage.objects.filter(sender_id=other_id, receiver_id=reader_id).order_by()
+        # A cursor past every message sent would mark future ones read
+        newest = Subquery(incoming.filter(id__lte=last_read_id).order_by('-id').values('id')[:1])
+        unread = Coalesce(Subquery(
+            incoming.filter(id__gt=last_read_id).values('receiver_id').annotate(count=Count('id')).values('count')
+        ), 0)
+        # One conditional UPDATE rather than read-then-write in a transaction:
+        # on SQLite concurrent read-then-write transactions fail to upgrade
+        # their locks and die with "database is locked"
+        changes = {f'last_read_{side}': newest, f'unread_{side}': unread}
+        conversations = cls.for_pair(reader_id, other_id).filter(**{f'last_read_{side}__lt': newest})
+        updated = conversations.update(**changes)
+        if not updated and not cls.for_pair(reader_id, other_id).exists():
+            cls.objects.bulk_create(
+                [cls(user_low_id=user_low_id, user_high_id=user_high_id)],
+                ignore_conflicts=True
+            )
+            updated = conversations.update(**changes)
+        if not updated:
+            return None
+        response_versions.bump((reader_id,))
+        return cls.for_pair(reader_id, other_id).first()
@@ -0,0 +1,28 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from ApiRoot.instrumentation import timed_serialization
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    # JSONRenderer's output, encoded with orjson when it is installed.
+    # Datetimes and anything orjson doesn't know go through DRF's encoder so
+    # timestamps keep DRF's format. One difference: NaN and infinite floats
+    # become null where JSONRenderer raises.
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed_serialization():
+            if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+                return super().render(data, accepted_media_type, renderer_context)
+            if data is None:
+                return b''
+            ret = orjson.dumps(data, default=JSONEncoder().default, option=self.options)
+            # Like JSONRenderer, escape the line and paragraph separators,
+            # which JSON allows raw but JavaScript string literals do not
+            return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,148 @@
+import re
+
+from django.db import connections, router, transaction
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+# Full-text search over chat messages.
+#
+# SQLite: a contentless FTS5 table keyed by message id, holding the message
+# text and a participants column ("u<sender> u<receiver>"), so scoping a
+# search to one user is part of the MATCH rather than a filter over every
+# user's hits. Rows are added by index_messages() in the same transaction as
+# the messages, and existing messages are indexed by the
+# rebuild_message_search command, which builds a full rebuild in
+# REBUILD_TABLE and swaps it in.
+#
+# Postgres: a GIN index on to_tsvector(content), which the database keeps in
+# sync by itself; scoping uses the sender/receiver indexes.
+#
+# Other backends have no search index and search() returns nothing.
+
+FTS_TABLE = 'chat_message_search'
+REBUILD_TABLE = 'chat_message_search_rebuild'
+TS_CONFIG = 'simple'
+MESSAGE_TABLE = 'users_chatmessage'
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def search_connection(write=False):
+    from .models import ChatMessage
+    route = router.db_for_write if write else router.db_for_read
+    return connections[route(ChatMessage)]
+
+
+def create_search_index(using=None, table=FTS_TABLE):
+    conn = connections[using] if using else search_connection(write=True)
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+                f"USING fts5(content, participants, content='')"
+            )
+        elif conn.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {FTS_TABLE} ON {MESSAGE_TABLE} "
+                f"USING GIN (to_tsvector('{TS_CONFIG}', content))"
+            )
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using, **kwargs):
+    # Vendor-specific and outside the model state, so created after migrate
+    # rather than by a migration
+    if sender.name == 'users':
+        create_search_index(using)
+
+
+def index_messages(messages, table=FTS_TABLE):
+    # Call in the same transaction as the insert. Postgres indexes by itself
+    conn = search_connection(write=True)
+    if conn.vendor != 'sqlite' or not messages:
+        return
+    with conn.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (rowid, content, participants) VALUES (%s, %s, %s)',
+            [(message.id, message.content, participants(message.sender_id, message.receiver_id)) for message in messages]
+        )
+
+
+def participants(sender_id, receiver_id):
+    return f'u{sender_id} u{receiver_id}'
+
+
+def fts_query(text):
+    """
+    Every word of `text` must appear, the last one as a prefix (so results
+    follow the user as they type). Words are quoted, so FTS5 operators in
+    the input are matched as plain text.
+    """
+    words = TOKEN_RE.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(user_id, text, limit, offset=0):
+    """
+    Ids of the messages sent or received by `user_id` that match `text`, best
+    match first, with ties broken by recency.
+    """
+    conn = search_connection()
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            query = fts_query(text)
+            if query is None:
+                return []
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, 1.0, 0.0), rowid DESC LIMIT %s OFFSET %s',
+                (f'content: ({query}) AND participants: u{user_id}', limit, offset)
+            )
+        elif conn.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT id FROM {MESSAGE_TABLE}, websearch_to_tsquery('{TS_CONFIG}', %s) query "
+                f"WHERE to_tsvector('{TS_CONFIG}', content) @@ query AND (sender_id = %s OR receiver_id = %s) "
+                f"ORDER BY ts_rank(to_tsvector('{TS_CONFIG}', content), query) DESC, id DESC LIMIT %s OFFSET %s",
+                (text, user_id, user_id, limit, offset)
+            )
+        else:
+            return []
+        return [row[0] for row in cursor.fetchall()]
+
+
+def indexed_ids(first_id, last_id, table=FTS_TABLE):
+    # A contentless table silently accepts a duplicate rowid, so backfills
+    # check which messages of a chunk are already there
+    with search_connection(write=True).cursor() as cursor:
+        cursor.execute(f'SELECT rowid FROM {table} WHERE rowid BETWEEN %s AND %s', (first_id, last_id))
+        return {row[0] for row in cursor.fetchall()}
+
+
+def swap_search_index(table=REBUILD_TABLE, batch_size=500):
+    """
+    Replace the live index with `table`, after adding to it the messages
+    that were indexed live while it was being built. One write transaction,
+    so no insert lands in the old table unseen. Returns how many messages
+    were caught up.
+    """
+    from .models import ChatMessage
+    conn = search_connection(write=True)
+    with transaction.atomic(using=conn.alias):
+        with conn.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {FTS_TABLE} EXCEPT SELECT rowid FROM {table}')
+            message_ids = [row[0] for row in cursor.fetchall()]
+            for start in range(0, len(message_ids), batch_size):
+                index_messages(list(ChatMessage.objects.filter(id__in=message_ids[start:start + batch_size])), table)
+            cursor.execute(f'DROP TABLE {FTS_TABLE}')
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {FTS_TABLE}')
+    return len(message_ids)
+
+
+def reindex():
+    # Postgres: rebuild the GIN index without blocking writes
+    with search_connection(write=True).cursor() as cursor:
+        cursor.execute(f'REINDEX INDEX CONCURRENTLY {FTS_TABLE}')
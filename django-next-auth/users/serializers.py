@@ -0,0 +1,70 @@
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.encoding import filepath_to_uri
+
+
+class MediaURLBuilder:
+    # Absolute media URLs with the scheme/host/MEDIA_URL prefix resolved once
+    # per request instead of calling build_absolute_uri for every file
+    __slots__ = ('request', 'prefix')
+
+    def __init__(self, request):
+        self.request = request
+        self.prefix = None
+        # Only local storage has a fixed prefix; anything else asks the storage
+        if isinstance(default_storage, FileSystemStorage):
+            self.prefix = request.build_absolute_uri(default_storage.base_url)
+
+    def url(self, file):
+        if not file:
+            return None
+        if self.prefix is not None:
+            return self.prefix + filepath_to_uri(file.name)
+        return self.request.build_absolute_uri(file.url)
+
+
+class UserCardSerializer:
+    """
+    The one place user cards are built: the potential-match feed, matches,
+    match requests, chat senders and the caller's own profile all use it.
+    Create one per request.
+    """
+    __slots__ = ('media',)
+
+    def __init__(self, request):
+        self.media = MediaURLBuilder(request)
+
+    def user(self, user, profile):
+        return {
+            'id': user.id,
+            'username': user.username,
+            'profile_picture': self.media.url(profile.card_picture),
+        }
+
+    def sender(self, user, profile):
+        return {
+            'username': user.username,
+            'profile_picture': self.media.url(profile.card_picture),
+        }
+
+    def card(self, user, profile, **extra):
+        data = {
+            'user': self.user(user, profile),
+            'school': profile.school,
+            'subjects_need_help': profile.subjects_need_help,
+            'subjects_can_teach': profile.subjects_can_teach,
+            'bio': profile.bio,
+        }
+        data.update(extra)
+        return data
+
+    def profile(self, user, profile):
+        return {
+            'username': user.username,
+            'role': profile.role,
+            'school': profile.school,
+            'profile_picture': self.media.url(profile.profile_picture),
+            'profile_thumbnail': self.media.url(profile.profile_thumbnail),
+            'subjects_need_help': profile.subjects_need_help,
+            'subjects_can_teach': profile.subjects_can_teach,
+            'bio': profile.bio,
+        }
@@ -0,0 +1,309 @@
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ApiRoot.routers import REPLICA_DB_ALIAS, use_replica
+from ApiRoot.settings import database_config
+
+from .cache import UserCache, potential_matches_cache, response_versions, user_cache
+
+from .models import ChatMessage, Conversation, Match, Profile, Subject
+
+
+class QueryCountTests(TestCase):
+    """
+    List endpoints must cost the same number of queries whatever number of
+    rows they return: each is checked at a small and a larger size.
+    """
+
+    ROW_COUNTS = (3, 30)
+
+    def setUp(self):
+        # Cached users, versions and presence would hide or add queries
+        cache.clear()
+
+    def create_user(self, name):
+        return get_user_model().objects.create_user(email=f'{name}@example.com', username=name)
+
+    def get(self, user, path):
+        client = APIClient()
+        client.force_authenticate(user)
+        cache.clear()
+        return client.get(path)
+
+    def test_matches_list(self):
+        for rows in self.ROW_COUNTS:
+            with self.subTest(rows=rows):
+                user = self.create_user(f'matches_{rows}')
+                for i in range(rows):
+                    other = self.create_user(f'matches_{rows}_{i}')
+                    # The user is on either side of a match
+                    if i % 2:
+                        Match.objects.create(user_a=user, user_b=other, status_a=Match.ACCEPTED, status_b=Match.ACCEPTED)
+                    else:
+                        Match.objects.create(user_a=other, user_b=user, status_a=Match.ACCEPTED, status_b=Match.ACCEPTED)
+                    message = ChatMessage.objects.create(sender=other, receiver=user, content='hi')
+                    Conversation.record_messages([message])
+                with self.assertNumQueries(2):
+                    response = self.get(user, '/matches/')
+                self.assertEqual(len(response.data), rows)
+
+    def test_match_requests(self):
+        for rows in self.ROW_COUNTS:
+            with self.subTest(rows=rows):
+                user = self.create_user(f'requests_{rows}')
+                for i in range(rows):
+                    other = self.create_user(f'requests_{rows}_{i}')
+                    Match.objects.create(user_a=other, user_b=user, status_a=Match.ACCEPTED, status_b=Match.PENDING)
+                with self.assertNumQueries(2):
+                    response = self.get(user, '/match-requests/')
+                self.assertEqual(len(response.data), rows)
+
+    def test_chat_history(self):
+        for rows in self.ROW_COUNTS:
+            with self.subTest(rows=rows):
+                user = self.create_user(f'history_{rows}')
+                other = self.create_user(f'history_{rows}_other')
+                Match.objects.create(user_a=user, user_b=other, status_a=Match.ACCEPTED, status_b=Match.ACCEPTED)
+                for i in range(rows):
+                    sender, receiver = (user, other) if i % 2 else (other, user)
+                    message = ChatMessage.objects.create(sender=sender, receiver=receiver, content=f'message {i}')
+                    Conversation.record_messages([message])
+                # Reading the page also advances the read cursor, once
+                with self.assertNumQueries(5):
+                    response = self.get(user, f'/chat-history/{other.id}/')
+                self.assertEqual(len(response.data), rows)
+                with self.assertNumQueries(3):
+                    response = self.get(user, f'/chat-history/{other.id}/')
+                self.assertEqual(len(response.data), rows)
+
+
+class UserCacheTests(TestCase):
+    """
+    The per-process user cache behind token authentication: its counters,
+    invalidation on save, and that saving a cached user never writes back
+    its cached profile.
+    """
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+
+    def create_user(self, name):
+        return get_user_model().objects.create_user(email=f'{name}@example.com', username=name)
+
+    def test_counts_hits_misses_and_evictions(self):
+        users = [self.create_user(f'stats_{i}') for i in range(3)]
+        users_cache = UserCache(ttl=60, max_size=2)
+
+        users_cache.get(users[0].id)
+        with self.assertNumQueries(0):
+            self.assertEqual(users_cache.get(users[0].id).username, 'stats_0')
+        users_cache.get(users[1].id)
+        users_cache.get(users[2].id)
+        # The least recently used entry went to make room
+        self.assertIsNone(users_cache.peek(users[0].id))
+
+        stats = users_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (1, 3, 1, 2))
+        self.assertEqual(stats['hit_rate'], 0.25)
+
+    def test_saves_invalidate_the_cached_user(self):
+        user = self.create_user('invalidated')
+        user_cache.get(user.id)
+
+        profile = Profile.objects.get(user=user)
+        profile.bio = 'Updated'
+        profile.save()
+        self.assertIsNone(user_cache.peek(user.id))
+        self.assertEqual(user_cache.get(user.id).profile.bio, 'Updated')
+
+        user.username = 'renamed'
+        user.save()
+        self.assertIsNone(user_cache.peek(user.id))
+        self.assertEqual(user_cache.get(user.id).username, 'renamed')
+
+    def test_saving_a_cached_user_keeps_newer_profile_changes(self):
+        user = self.create_user('cached')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        self.assertEqual(client.get('/auth/users/me/').status_code, 200)
+
+        # Saved by another process, so this process's cached copy of the
+        # user and profile is not invalidated
+        Profile.objects.filter(user=user).update(bio='Saved elsewhere')
+
+        response = client.patch('/auth/users/me/', {'username': 'renamed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_user_model().objects.get(id=user.id).username, 'renamed')
+        self.assertEqual(Profile.objects.get(user=user).bio, 'Saved elsewhere')
+
+
+class PotentialMatchesCacheTests(TransactionTestCase):
+    """
+    Cached feed pages are kept per viewer: an edit to a profile only makes
+    stale the feeds that show its card. Transactional, because stale pages
+    are rebuilt on a worker thread that must see the test's rows.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def create_profile(self, name, need_help, can_teach):
+        user = get_user_model().objects.create_user(email=f'{name}@example.com', username=name)
+        profile = Profile.objects.get(user=user)
+        profile.subjects_need_help = need_help
+        profile.subjects_can_teach = can_teach
+        profile.is_onboarded = True
+        profile.save()
+        return user
+
+    def get(self, user, etag=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return client.get('/potential-matches/', **headers)
+
+    def get_until_modified(self, user, etag):
+        # Revalidate as a client would until the stale page has been rebuilt
+        deadline = time.monotonic() + 5
+        while True:
+            response = self.get(user, etag)
+            if response.status_code != 304:
+                return response
+            self.assertLess(time.monotonic(), deadline, 'Stale feed page was never rebuilt')
+            time.sleep(0.01)
+
+    def bios(self, response):
+        return [card['bio'] for card in response.data['results']]
+
+    def test_candidate_edit_only_makes_its_viewers_stale(self):
+        viewer = self.create_profile('viewer', ['Calculus'], ['History'])
+        candidate = self.create_profile('candidate', ['History'], ['Calculus'])
+        other_viewer = self.create_profile('other_viewer', ['Biology'], ['Chemistry'])
+        self.create_profile('other_candidate', ['Chemistry'], ['Biology'])
+
+        etags = {user: self.get(user)['ETag'] for user in (viewer, other_viewer)}
+        versions = {user: response_versions.get(user.id) for user in (viewer, other_viewer)}
+
+        profile = Profile.objects.get(user=candidate)
+        profile.bio = 'Now tutoring online'
+        profile.save()
+
+        # Feeds that don't show the candidate are untouched
+        self.assertEqual(response_versions.get(other_viewer.id), versions[other_viewer])
+        self.assertEqual(self.get(other_viewer, etags[other_viewer]).status_code, 304)
+
+        # The viewer's page is stale: what the client has is still served
+        # while it is rebuilt, then the rebuilt page replaces it
+        self.assertNotEqual(response_versions.get(viewer.id), versions[viewer])
+        self.assertEqual(self.get(viewer, etags[viewer]).status_code, 304)
+        response = self.get_until_modified(viewer, etags[viewer])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etags[viewer])
+        self.assertEqual(self.bios(response), ['Now tutoring online'])
+
+    def test_invalidated_pages_are_rebuilt_on_the_next_request(self):
+        viewer = self.create_profile('viewer', ['Calculus'], ['History'])
+        candidate = self.create_profile('candidate', ['History'], ['Calculus'])
+        self.assertEqual(self.bios(self.get(viewer)), [''])
+
+        # Behind the signals' back, so only invalidate() can surface it
+        Profile.objects.filter(user=candidate).update(bio='Changed')
+        self.assertEqual(self.bios(self.get(viewer)), [''])
+        potential_matches_cache.invalidate((viewer.id,))
+        self.assertEqual(self.bios(self.get(viewer)), ['Changed'])
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    """
+    ReplicaRouter against two SQLite files: a primary, and a replica that
+    only has what replicate() last copied to it, like one that lags.
+    """
+
+    databases = {'default'}
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        primary = os.path.join(directory.name, 'primary.sqlite3')
+        self.replica = os.path.join(directory.name, 'replica.sqlite3')
+
+        # Both files start from the test database's schema
+        test_database = connections['default']
+        test_database.ensure_connection()
+        with closing(sqlite3.connect(primary)) as target:
+            test_database.connection.backup(target)
+
+        databases = patch.dict(connections.settings, connections.configure_settings({
+            'default': database_config(name=primary),
+            REPLICA_DB_ALIAS: database_config(name=self.replica),
+        }))
+        databases.start()
+        self.addCleanup(databases.stop)
+        connections['default'] = connections.create_connection('default')
+        self.addCleanup(connections.__setitem__, 'default', test_database)
+        self.addCleanup(connections.__delitem__, REPLICA_DB_ALIAS)
+        self.addCleanup(connections.close_all)
+        # The runner only knows the aliases of the settings it started with,
+        # so the replica is connected here rather than listed in `databases`
+        connections[REPLICA_DB_ALIAS].connect()
+        self.replicate()
+
+    def replicate(self):
+        connections['default'].ensure_connection()
+        with closing(sqlite3.connect(self.replica)) as target:
+            connections['default'].connection.backup(target)
+
+    def test_reads_inside_use_replica_go_to_the_replica(self):
+        Subject.objects.create(name='Algebra')
+        with use_replica():
+            self.assertFalse(Subject.objects.filter(name='Algebra').exists())
+        self.assertTrue(Subject.objects.filter(name='Algebra').exists())
+
+        self.replicate()
+        with use_replica():
+            self.assertTrue(Subject.objects.filter(name='Algebra').exists())
+
+    def test_writes_go_to_the_primary(self):
+        with use_replica():
+            Subject.objects.create(name='Geometry')
+        self.assertTrue(Subject.objects.filter(name='Geometry').exists())
+        self.assertFalse(Subject.objects.using(REPLICA_DB_ALIAS).filter(name='Geometry').exists())
+
+    def test_reads_inside_a_transaction_stay_on_the_primary(self):
+        with use_replica(), transaction.atomic():
+            Subject.objects.create(name='Physics')
+            self.assertTrue(Subject.objects.filter(name='Physics').exists())
+
+    def test_reads_go_to_the_primary_without_a_replica(self):
+        Subject.objects.create(name='Chemistry')
+        del connections.settings[REPLICA_DB_ALIAS]
+        with use_replica():
+            self.assertTrue(Subject.objects.filter(name='Chemistry').exists())
+
+    def test_replica_is_not_migrated(self):
+        self.assertTrue(router.allow_migrate('default', 'users'))
+        self.assertFalse(router.allow_migrate(REPLICA_DB_ALIAS, 'users'))
+
+    def test_versioned_views_read_the_primary(self):
+        user = get_user_model().objects.create_user(email='replica_user@example.com', username='replica_user')
+        other = get_user_model().objects.create_user(email='replica_other@example.com', username='replica_other')
+        self.replicate()
+        Match.objects.create(user_a=user, user_b=other, status_a=Match.ACCEPTED, status_b=Match.ACCEPTED)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/matches/')
+        self.assertEqual([match['user']['id'] for match in response.data], [other.id])
@@ -1,38 +1,129 @@
 from rest_framework.views import APIView
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 import json
+import base64
+import binascii
+import hashlib
+from functools import wraps
 from django.db.models import Q
 from django.contrib.auth import get_user_model
-from .models import Match, Profile, ChatMessage
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from django.db import transaction
+from ApiRoot.routers import replica_reads
+from chat.events import conversation_id, message_event, notify_users, read_event
+from .models import Profile, Match, MatchCandidate, ChatMessage, Conversation
+from . import search
+from .cache import user_cache, response_versions, potential_matches_cache, presence, mutual_match_cache
+from .images import prepare_profile_picture, set_profile_picture
+from .serializers import UserCardSerializer
+
+def encode_cursor(*values):
+    # Opaque keyset cursor, e.g. (score, profile_id) of the last row on a page
+    raw = ':'.join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, size=2):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    values = tuple(int(value) for value in raw.split(':'))
+    if len(values) != size:
+        raise ValueError('Invalid cursor')
+    return values
+
+def page_params(request, default, maximum, cursor_size=None):
+    # The `limit` query parameter, capped at `maximum` and `default` when
+    # missing or below 1, and with `cursor_size` the decoded `cursor`.
+    # Raises ValueError when either is malformed
+    limit = min(int(request.query_params.get('limit', default)), maximum)
+    if limit < 1:
+        limit = default
+    cursor = decode_cursor(request.query_params.get('cursor'), size=cursor_size) if cursor_size else None
+    return limit, cursor
+
+def response_etag(request, version):
+    key = f'{request.user.id}:{version}:{request.get_full_path()}:{request.META.get("HTTP_ACCEPT", "")}'
+    return '"%s"' % hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+def versioned_etag(get):
+    """
+    Conditional GET for views whose response only changes when the user's
+    response version is bumped. The ETag is derived from that version and
+    the request, so a matching If-None-Match gets a 304 before the view
+    runs any queries. The version is left on `request.response_version`;
+    a view serving older data sets `etag_version` on its response.
+
+    Versions are bumped when the primary commits, so these views read from
+    the primary: a page built from a lagging replica would be cached and
+    tagged with a version whose changes it does not contain.
+    """
+    @wraps(get)
+    def wrapper(self, request, *args, **kwargs):
+        request.response_version = response_versions.get(request.user.id)
+        etag = response_etag(request, request.response_version)
+        client_etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+
+        if etag in client_etags:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = get(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            etag = response_etag(request, getattr(response, 'etag_version', request.response_version))
+            # Older data served while it is rebuilt may be what the client
+            # already has
+            if etag in client_etags:
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        response['ETag'] = etag
+        # Per-user data: browsers may keep it but must revalidate every time
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+    return wrapper
 
 class OnboardingView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         try:
-            profile = request.user.profile
-            
-            # Get data from form-data
-            profile.role = request.data.get('role', 'student')
-            profile.school = request.data.get('school', '')
-            profile.bio = request.data.get('bio', '')
-
-            # Handle JSON strings for subjects
-            subjects_need_help = request.data.get('subjects_need_help', '[]')
-            subjects_can_teach = request.data.get('subjects_can_teach', '[]')
-            
-            # Parse JSON strings to Python lists
-            profile.subjects_need_help = json.loads(subjects_need_help)
-            profile.subjects_can_teach = json.loads(subjects_can_teach)
-
-            # Handle profile picture
+            # Decode and re-encode the picture before locking the profile;
+            # thumbnails are generated in the background
+            picture = None
             if 'profile_picture' in request.FILES:
-                profile.profile_picture = request.FILES['profile_picture']
-            
-            profile.is_onboarded = True
-            profile.save()
+                picture = prepare_profile_picture(request.FILES['profile_picture'])
+
+            with transaction.atomic():
+                # Edit a fresh copy: the cached one can lag other processes'
+                # saves by USER_CACHE_TTL, and save() writes every column back
+                profile = Profile.objects.select_for_update().get(user_id=request.user.id)
+
+                # Get data from form-data
+                profile.role = request.data.get('role', 'student')
+                profile.school = request.data.get('school', '')
+                profile.bio = request.data.get('bio', '')
+
+                # Handle JSON strings for subjects
+                subjects_need_help = request.data.get('subjects_need_help', '[]')
+                subjects_can_teach = request.data.get('subjects_can_teach', '[]')
+
+                # Parse JSON strings to Python lists
+                profile.subjects_need_help = json.loads(subjects_need_help)
+                profile.subjects_can_teach = json.loads(subjects_can_teach)
+
+                # Handle profile picture
+                if picture is not None:
+                    set_profile_picture(profile, picture)
+
+                profile.is_onboarded = True
+                profile.save()
             
             return Response({
                 'status': 'success',
@@ -55,64 +146,60 @@ class OnboardingView(APIView):
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @versioned_etag
     def get(self, request):
-        profile = request.user.profile
-        return Response({
-            'username': request.user.username,
-            'role': profile.role,
-            'school': profile.school,
-            'profile_picture': request.build_absolute_uri(profile.profile_picture.url) if profile.profile_picture else None,
-            'subjects_need_help': profile.subjects_need_help,
-            'subjects_can_teach': profile.subjects_can_teach,
-            'bio': profile.bio,
-        })
+        # Read the profile fresh rather than from the user cache, which can
+        # lag other processes' saves by its TTL
+        profile = Profile.objects.select_related('user').get(user_id=request.user.id)
+        return Response(UserCardSerializer(request).profile(profile.user, profile))
 
     def put(self, request):
         try:
-            profile = request.user.profile
-            user = request.user
-
-            # Handle username update
-            new_username = request.data.get('username')
-            if new_username and new_username != user.username:
-                # Check if username is already taken
-                from django.contrib.auth import get_user_model
-                User = get_user_model()
-                if User.objects.filter(username=new_username).exists():
-                    return Response({
-                        'status': 'error',
-                        'message': 'Username already taken'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                user.username = new_username
-                user.save()
-            
-            # Handle existing profile fields
-            profile.role = request.data.get('role', profile.role)
-            profile.school = request.data.get('school', profile.school)
-            profile.bio = request.data.get('bio', profile.bio)
-
-            subjects_need_help = request.data.get('subjects_need_help')
-            subjects_can_teach = request.data.get('subjects_can_teach')
-            
-            if subjects_need_help:
-                profile.subjects_need_help = json.loads(subjects_need_help)
-            if subjects_can_teach:
-                profile.subjects_can_teach = json.loads(subjects_can_teach)
-
+            # Decode and re-encode the picture before locking the profile
+            picture = None
             if 'profile_picture' in request.FILES:
-                profile.profile_picture = request.FILES['profile_picture']
+                picture = prepare_profile_picture(request.FILES['profile_picture'])
+
+            with transaction.atomic():
+                # Edit fresh copies: the cached user and profile can lag other
+                # processes' saves by USER_CACHE_TTL, and save() writes every
+                # column back
+                profile = Profile.objects.select_for_update().select_related('user').get(user_id=request.user.id)
+                user = profile.user
+
+                # Handle username update
+                new_username = request.data.get('username')
+                if new_username and new_username != user.username:
+                    # Check if username is already taken
+                    from django.contrib.auth import get_user_model
+                    User = get_user_model()
+                    if User.objects.filter(username=new_username).exists():
+                        return Response({
+                            'status': 'error',
+                            'message': 'Username already taken'
+                        }, status=status.HTTP_400_BAD_REQUEST)
+                    user.username = new_username
+                    user.save()
+
+                # Handle existing profile fields
+                profile.role = request.data.get('role', profile.role)
+                profile.school = request.data.get('school', profile.school)
+                profile.bio = request.data.get('bio', profile.bio)
+
+                subjects_need_help = request.data.get('subjects_need_help')
+                subjects_can_teach = request.data.get('subjects_can_teach')
+
+                if subjects_need_help:
+                    profile.subjects_need_help = json.loads(subjects_need_help)
+                if subjects_can_teach:
+                    profile.subjects_can_teach = json.loads(subjects_can_teach)
+
+                if picture is not None:
+                    set_profile_picture(profile, picture)
+
+                profile.save()
             
-            profile.save()
-            
-            return Response({
-                'username': user.username,
-                'role': profile.role,
-                'school': profile.school,
-                'profile_picture': request.build_absolute_uri(profile.profile_picture.url) if profile.profile_picture else None,
-                'subjects_need_help': profile.subjects_need_help,
-                'subjects_can_teach': profile.subjects_can_teach,
-                'bio': profile.bio,
-            })
+            return Response(UserCardSerializer(request).profile(user, profile))
             
         except Exception as e:
             return Response({
@@ -122,7 +209,10 @@ class ProfileView(APIView):
 
 class PotentialMatchesView(APIView):
     permission_classes = [IsAuthenticated]
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 50
 
+    @versioned_etag
     def get(self, request):
 
         # # For testing/demo purposes, return mock data
@@ -171,55 +261,65 @@ class PotentialMatchesView(APIView):
 
 
         user = request.user
-        profile = user.profile
-        
-        # Get all existing matches for this user
-        existing_matches = Match.objects.filter(
-            Q(user_a=user) | Q(user_b=user)
-        ).values_list('user_a_id', 'user_b_id')
-        
-        # Flatten and combine matched user IDs
-        matched_users = set()
-        for match in existing_matches:
-            matched_users.update(match)
-        
-        # Remove the current user from the set
-        matched_users.discard(user.id)
-        
-        # Find potential matches based on subjects and school
-        potential_matches = Profile.objects.exclude(
-            user_id__in=matched_users
-        ).exclude(
-            user=user
-        ).filter(
-            is_onboarded=True      # Only onboarded users
+
+        try:
+            limit, cursor = page_params(request, self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE, cursor_size=2)
+        except ValueError:
+            return Response(
+                {'error': 'Invalid cursor or limit'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Pages are cached per user; a stale page is served while it is
+        # rebuilt in the background, and its ETag names the version it was
+        # built from so the client revalidates again next time
+        page_key = f'{request.build_absolute_uri("/")}:{request.query_params.get("cursor", "")}:{limit}'
+        payload, built_from = potential_matches_cache.get(
+            user.id,
+            page_key,
+            request.response_version,
+            lambda: self.build_page(request, user, cursor, limit)
         )
+        response = Response(payload)
+        response.etag_version = built_from
+        return response
+
+    def build_page(self, request, user, cursor, limit):
+        # Read one page of the precomputed, already scored candidate table
+        candidates = MatchCandidate.objects.filter(
+            user=user,
+            has_match=False
+        ).select_related('candidate__profile').order_by('-score', '-candidate_id')
+        if cursor:
+            last_score, last_candidate_id = cursor
+            candidates = candidates.filter(
+                Q(score__lt=last_score) |
+                Q(score=last_score, candidate_id__lt=last_candidate_id)
+            )
+        page = list(candidates[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        serializer = UserCardSerializer(request)
+        matches = [
+            serializer.card(
+                match_candidate.candidate,
+                match_candidate.candidate.profile,
+                can_help_with=match_candidate.can_help_with,
+                can_get_help_with=match_candidate.can_get_help_with,
+                score=match_candidate.score
+            )
+            for match_candidate in page
+        ]
 
-        # Filter based on subject matches
-        matches = []
-        for potential_match in potential_matches:
-            # Check if there's any overlap between what user can teach and what potential match needs
-            can_help_with = set(profile.subjects_can_teach) & set(potential_match.subjects_need_help)
-            # Check if there's any overlap between what user needs and what potential match can teach
-            can_get_help_with = set(profile.subjects_need_help) & set(potential_match.subjects_can_teach)
-            
-            # If there's at least one subject match in either direction
-            if can_help_with or can_get_help_with:
-                matches.append({
-                    'user': {
-                        'id': potential_match.user.id,
-                        'username': potential_match.user.username,
-                        'profile_picture': request.build_absolute_uri(potential_match.profile_picture.url) if potential_match.profile_picture else None,
-                    },
-                    'school': potential_match.school,
-                    'subjects_need_help': potential_match.subjects_need_help,
-                    'subjects_can_teach': potential_match.subjects_can_teach,
-                    'bio': potential_match.bio,
-                    'can_help_with': list(can_help_with),
-                    'can_get_help_with': list(can_get_help_with)
-                })
-        
-        return Response(matches)
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(page[-1].score, page[-1].candidate_id)
+
+        return {
+            'results': matches,
+            'next_cursor': next_cursor
+        }
 
 class MatchActionView(APIView):
     permission_classes = [IsAuthenticated]
@@ -249,6 +349,7 @@ class MatchActionView(APIView):
 class MatchesListView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @versioned_etag
     def get(self, request):
         user = request.user
         
@@ -256,31 +357,34 @@ class MatchesListView(APIView):
         matches = Match.objects.filter(
             (Q(user_a=user) & Q(status_a=Match.ACCEPTED) & Q(status_b=Match.ACCEPTED)) |
             (Q(user_b=user) & Q(status_a=Match.ACCEPTED) & Q(status_b=Match.ACCEPTED))
-        )
+        ).select_related('user_a__profile', 'user_b__profile')
+
+        # Unread counts come from the maintained per-conversation counters
+        unread_counts = {
+            conversation.other_user_id(user.id): conversation.unread(user.id)
+            for conversation in Conversation.for_user(user.id)
+        }
         
+        # Presence changes bump this list's version, see ChatConsumer
+        other_users = [match.user_b if match.user_a_id == user.id else match.user_a for match in matches]
+        online = presence.online([other_user.id for other_user in other_users])
+
+        serializer = UserCardSerializer(request)
         matched_users = []
-        for match in matches:
-            # Get the other user in the match
-            other_user = match.user_b if match.user_a == user else match.user_a
-            other_profile = other_user.profile
-            
-            matched_users.append({
-                'user': {
-                    'id': other_user.id,
-                    'username': other_user.username,
-                    'profile_picture': request.build_absolute_uri(other_profile.profile_picture.url) if other_profile.profile_picture else None,
-                },
-                'school': other_profile.school,
-                'subjects_need_help': other_profile.subjects_need_help,
-                'subjects_can_teach': other_profile.subjects_can_teach,
-                'bio': other_profile.bio,
-            })
+        for other_user in other_users:
+            matched_users.append(serializer.card(
+                other_user,
+                other_user.profile,
+                unread_count=unread_counts.get(other_user.id, 0),
+                online=other_user.id in online
+            ))
         
         return Response(matched_users)
 
 class MatchRequestsView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @versioned_etag
     def get(self, request):
         user = request.user
         
@@ -289,60 +393,114 @@ class MatchRequestsView(APIView):
             user_b=user,
             status_a=Match.ACCEPTED,
             status_b=Match.PENDING
-        )
+        ).select_related('user_a__profile')
         
+        # Subject overlaps come from the requester's precomputed candidate row
+        overlaps = {
+            candidate.user_id: candidate
+            for candidate in MatchCandidate.objects.filter(
+                user_id__in=pending_matches.values('user_a_id'),
+                candidate=user
+            )
+        }
+
+        serializer = UserCardSerializer(request)
         match_requests = []
         for match in pending_matches:
             other_user = match.user_a
-            other_profile = other_user.profile
-            
-            # Calculate subject overlaps
-            can_help_with = set(other_profile.subjects_can_teach) & set(user.profile.subjects_need_help)
-            can_get_help_with = set(other_profile.subjects_need_help) & set(user.profile.subjects_can_teach)
-            
-            match_requests.append({
-                'user': {
-                    'id': other_user.id,
-                    'username': other_user.username,
-                    'profile_picture': request.build_absolute_uri(other_profile.profile_picture.url) if other_profile.profile_picture else None,
-                },
-                'school': other_profile.school,
-                'subjects_need_help': other_profile.subjects_need_help,
-                'subjects_can_teach': other_profile.subjects_can_teach,
-                'bio': other_profile.bio,
-                'can_help_with': list(can_help_with),
-                'can_get_help_with': list(can_get_help_with)
-            })
+            overlap = overlaps.get(other_user.id)
+            match_requests.append(serializer.card(
+                other_user,
+                other_user.profile,
+                can_help_with=overlap.can_help_with if overlap else [],
+                can_get_help_with=overlap.can_get_help_with if overlap else []
+            ))
         
         return Response(match_requests)
 
 class ChatHistoryView(APIView):
     permission_classes = [IsAuthenticated]
+    DEFAULT_PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 200
 
+    # Not on the replica: the read cursor is advanced from what this page
+    # reads, and polling must see a message as soon as its sender's
+    # request has returned
     def get(self, request, user_id):
         try:
-            other_user = get_user_model().objects.get(id=user_id)
+            other_user = get_user_model().objects.select_related('profile').get(id=user_id)
             
+            try:
+                limit, _ = page_params(request, self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE)
+                after_id = request.query_params.get('after_id')
+                before_id = request.query_params.get('before_id')
+                since = request.query_params.get('since')
+                after_id = int(after_id) if after_id else None
+                before_id = int(before_id) if before_id else None
+                if since:
+                    since = parse_datetime(since)
+                    if since is None:
+                        raise ValueError('Invalid since')
+                    if timezone.is_naive(since):
+                        since = timezone.make_aware(since)
+                else:
+                    since = None
+            except ValueError:
+                return Response(
+                    {'error': 'Invalid after_id, before_id, since or limit'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             # Get messages between the two users
             messages = ChatMessage.objects.filter(
                 (Q(sender=request.user, receiver=other_user) |
                 Q(sender=other_user, receiver=request.user))
-            ).order_by('timestamp')
-            
-            # Mark unread messages as read
-            messages.filter(receiver=request.user, is_read=False).update(is_read=True)
+            )
+
+            # Polling only asks for what arrived after the last message it has
+            # seen; scrolling back pages through older messages
+            if after_id is not None or since is not None:
+                if since is not None:
+                    messages = messages.filter(timestamp__gt=since)
+                if after_id is not None:
+                    messages = ChatMessage.after(messages, after_id, limit)
+                else:
+                    messages = list(messages.order_by('timestamp', 'id')[:limit])
+            else:
+                if before_id is not None:
+                    messages = messages.filter(id__lt=before_id)
+                messages = list(messages.order_by('-timestamp', '-id')[:limit])
+                messages.reverse()
+
+            # Advance the reader's cursor (one row, and only when this page
+            # has something past it) and tell the other side over the socket
+            conversation = Conversation.for_pair(request.user.id, other_user.id).first()
+            incoming = [msg.id for msg in messages if msg.receiver_id == request.user.id]
+            if incoming and (conversation is None or incoming[-1] > conversation.last_read(request.user.id)):
+                updated = Conversation.mark_read(request.user.id, other_user.id, incoming[-1])
+                if updated:
+                    conversation = updated
+                    notify_users(
+                        (request.user.id, other_user.id),
+                        read_event(request.user.id, other_user.id, incoming[-1])
+                    )
+
+            # Every message is sent by one of the two participants, so build
+            # their sender payloads once instead of loading a sender per row
+            serializer = UserCardSerializer(request)
+            senders = {
+                participant.id: serializer.sender(participant, participant.profile)
+                for participant in (request.user, other_user)
+            }
             
             messages_data = [{
                 'id': msg.id,
                 'content': msg.content,
-                'sender_id': msg.sender.id,
-                'receiver_id': msg.receiver.id,
+                'sender_id': msg.sender_id,
+                'receiver_id': msg.receiver_id,
                 'timestamp': msg.timestamp,
-                'is_read': msg.is_read,
-                'sender': {
-                    'username': msg.sender.username,
-                    'profile_picture': request.build_absolute_uri(msg.sender.profile.profile_picture.url) if msg.sender.profile.profile_picture else None,
-                }
+                'is_read': conversation.is_read(msg) if conversation else False,
+                'sender': senders[msg.sender_id]
             } for msg in messages]
             
             return Response(messages_data)
@@ -353,6 +511,111 @@ class ChatHistoryView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+class ConversationListView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+
+    @versioned_etag
+    def get(self, request):
+        user = request.user
+
+        try:
+            limit, cursor = page_params(request, self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE, cursor_size=1)
+        except ValueError:
+            return Response(
+                {'error': 'Invalid cursor or limit'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # The conversations themselves carry the last message and unread
+        # counts; only the other participants' cards need a second query
+        page = Conversation.recent_for_user(user.id, cursor[0] if cursor else None, limit + 1)
+        has_more = len(page) > limit
+        page = page[:limit]
+        other_ids = [conversation.other_user_id(user.id) for conversation in page]
+        others = get_user_model().objects.select_related('profile').in_bulk(other_ids)
+        online = presence.online(other_ids)
+
+        serializer = UserCardSerializer(request)
+        conversations = []
+        for conversation, other_id in zip(page, other_ids):
+            other_user = others.get(other_id)
+            if other_user is None:
+                continue
+            conversations.append({
+                'conversation': conversation_id(user.id, other_id),
+                'user': serializer.user(other_user, other_user.profile),
+                'last_message': {
+                    'id': conversation.last_message_id,
+                    'content': conversation.last_preview,
+                    'sender_id': conversation.last_sender_id,
+                    'timestamp': conversation.last_timestamp,
+                },
+                'unread_count': conversation.unread(user.id),
+                'online': other_id in online,
+            })
+
+        return Response({
+            'results': conversations,
+            'next_cursor': encode_cursor(page[-1].last_message_id) if has_more else None
+        })
+
+class MessageSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 50
+    # Relevance pages are offsets; past this, refine the query instead
+    MAX_OFFSET = 1000
+
+    @replica_reads
+    def get(self, request):
+        user = request.user
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'Search query is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            limit, cursor = page_params(request, self.DEFAULT_PAGE_SIZE, self.MAX_PAGE_SIZE, cursor_size=1)
+        except ValueError:
+            return Response(
+                {'error': 'Invalid cursor or limit'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        offset = min(cursor[0], self.MAX_OFFSET) if cursor else 0
+
+        # The index returns ranked ids already scoped to the user's
+        # conversations; the page of messages is one more query
+        message_ids = search.search(user.id, query, limit + 1, offset)
+        has_more = len(message_ids) > limit and offset + limit < self.MAX_OFFSET
+        message_ids = message_ids[:limit]
+        messages = ChatMessage.objects.in_bulk(message_ids)
+
+        results = []
+        for message_id in message_ids:
+            # Index rows can outlive messages deleted with their users
+            msg = messages.get(message_id)
+            if msg is None:
+                continue
+            results.append({
+                'id': msg.id,
+                'conversation': conversation_id(msg.sender_id, msg.receiver_id),
+                'content': msg.content,
+                'sender_id': msg.sender_id,
+                'receiver_id': msg.receiver_id,
+                'timestamp': msg.timestamp,
+            })
+
+        return Response({
+            'results': results,
+            'next_cursor': encode_cursor(offset + limit) if has_more else None
+        })
+
 class MessageView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -367,28 +630,44 @@ class MessageView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            # Same rule as the chat socket: only mutual matches can message
+            if not mutual_match_cache.get(request.user.id, receiver.id):
+                return Response(
+                    {'error': 'Not matched with this user'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
             # Create new message
-            message = ChatMessage.objects.create(
-                sender=request.user,
-                receiver=receiver,
-                content=content
-            )
+            with transaction.atomic():
+                message = ChatMessage.objects.create(
+                    sender=request.user,
+                    receiver=receiver,
+                    content=content
+                )
+                Conversation.record_messages([message])
+
+            # Push it to both participants' open chat sockets
+            notify_users((request.user.id, receiver.id), message_event(message))
 
             return Response({
                 'id': message.id,
                 'content': message.content,
-                'sender_id': message.sender.id,
-                'receiver_id': message.receiver.id,
+                'sender_id': message.sender_id,
+                'receiver_id': message.receiver_id,
                 'timestamp': message.timestamp,
-                'is_read': message.is_read,
-                'sender': {
-                    'username': message.sender.username,
-                    'profile_picture': request.build_absolute_uri(message.sender.profile.profile_picture.url) if message.sender.profile.profile_picture else None,
-                }
+                'is_read': False,
+                'sender': UserCardSerializer(request).sender(request.user, request.user.profile)
             })
 
         except get_user_model().DoesNotExist:
             return Response(
                 {'error': 'User not found'},
                 status=status.HTTP_404_NOT_FOUND
-            )
\ No newline at end of file
+            )
+
+class UserCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Counters are per process
+        return Response(user_cache.stats())
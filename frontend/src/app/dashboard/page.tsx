@@ -1,6 +1,7 @@
 "use client";
 
-import useSWR, { mutate } from "swr";
+import useSWR from "swr";
+import useSWRInfinite from "swr/infinite";
 import { fetcher } from "@/app/fetcher";
 import { useRouter } from "next/navigation";
 import wretch from "wretch";
@@ -18,20 +19,40 @@ interface PotentialMatch {
     bio: string;
     can_help_with: string[];
     can_get_help_with: string[];
+    score: number;
 }
 
+interface PotentialMatchPage {
+    results: PotentialMatch[];
+    next_cursor: string | null;
+}
+
+const PAGE_SIZE = 20;
+
+// Cursor-paginated feed: each page key carries the cursor from the previous page
+const getPageKey = (pageIndex: number, previousPage: PotentialMatchPage | null) => {
+    if (previousPage && !previousPage.next_cursor) return null;
+    if (pageIndex === 0) return `/potential-matches/?limit=${PAGE_SIZE}`;
+    return `/potential-matches/?limit=${PAGE_SIZE}&cursor=${previousPage!.next_cursor}`;
+};
+
 export default function Dashboard() {
     const router = useRouter();
     const { data: user } = useSWR("/auth/users/me", fetcher);
-    const { data: matches } = useSWR<PotentialMatch[]>("/potential-matches", fetcher);
+    const { data: pages, mutate: mutateMatches, size, setSize } = useSWRInfinite<PotentialMatchPage>(getPageKey, fetcher);
+    const matches = pages?.flatMap(page => page.results);
+    const hasMore = pages ? pages[pages.length - 1].next_cursor !== null : false;
     const { data: matchRequests } = useSWR<any[]>('/match-requests', fetcher);
 
     const handleMatch = async (userId: number) => {
         try {
             // Immediately remove the matched profile from the UI
-            if (matches) {
-                const updatedMatches = matches.filter(match => match.user.id !== userId);
-                mutate('/potential-matches', updatedMatches, false); // Update UI immediately
+            if (pages) {
+                const updatedPages = pages.map(page => ({
+                    ...page,
+                    results: page.results.filter(match => match.user.id !== userId),
+                }));
+                mutateMatches(updatedPages, false); // Update UI immediately
             }
 
             // Make the API call
@@ -41,20 +62,23 @@ export default function Dashboard() {
                 .post({ action: 'accept' });
             
             // Refresh the data in the background
-            mutate('/potential-matches');
+            mutateMatches();
         } catch (error) {
             console.error('Error matching:', error);
             // If there's an error, refresh the data to restore the original state
-            mutate('/potential-matches');
+            mutateMatches();
         }
     };
 
     const handlePass = async (userId: number) => {
         try {
             // Immediately remove the passed profile from the UI
-            if (matches) {
-                const updatedMatches = matches.filter(match => match.user.id !== userId);
-                mutate('/potential-matches', updatedMatches, false); // Update UI immediately
+            if (pages) {
+                const updatedPages = pages.map(page => ({
+                    ...page,
+                    results: page.results.filter(match => match.user.id !== userId),
+                }));
+                mutateMatches(updatedPages, false); // Update UI immediately
             }
 
             // Make the API call
@@ -64,11 +88,11 @@ export default function Dashboard() {
                 .post({ action: 'reject' });
             
             // Refresh the data in the background
-            mutate('/potential-matches');
+            mutateMatches();
         } catch (error) {
             console.error('Error passing:', error);
             // If there's an error, refresh the data to restore the original state
-            mutate('/potential-matches');
+            mutateMatches();
         }
     };
 
@@ -172,6 +196,17 @@ export default function Dashboard() {
                         </div>
                     ))}
                 </div>
+
+                {hasMore && (
+                    <div className="flex justify-center mt-8">
+                        <button
+                            onClick={() => setSize(size + 1)}
+                            className="bg-blue-500 text-white px-4 py-2 rounded hover:bg-blue-700 transition-colors"
+                        >
+                            Load more
+                        </button>
+                    </div>
+                )}
             </div>
         </div>
     );
@@ -2,7 +2,7 @@
 
 import React, { useState, useEffect, useRef } from 'react';
 import { useRouter } from 'next/navigation';
-import useSWR from 'swr';
+import useSWR, { mutate } from 'swr';
 import { fetcher } from '@/app/fetcher';
 import { getToken } from '@/app/auth/utils';
 
@@ -29,8 +29,34 @@ interface MatchedUser {
     subjects_need_help: string[];
     subjects_can_teach: string[];
     bio: string;
+    unread_count: number;
+    online: boolean;
 }
 
+interface ConversationSummary {
+    conversation: string;
+    user: { id: number };
+    last_message: {
+        id: number;
+        content: string;
+        sender_id: number;
+        timestamp: string;
+    };
+}
+
+const CHAT_PAGE_SIZE = 50;
+const CONVERSATIONS_KEY = '/conversations/?limit=100';
+// Heartbeats keep us online (the server forgets a user after 60s without one)
+const HEARTBEAT_MS = 25000;
+// Typing events go out at most this often, and show for this long
+const TYPING_SEND_MS = 1000;
+const TYPING_SHOW_MS = 3000;
+
+const WS_URL = process.env.NEXT_PUBLIC_WS_URL || (process.env.NEXT_PUBLIC_API_URL || '').replace(/^http/, 'ws');
+
+// Chat frames name their conversation by the two user ids, smaller first
+const conversationId = (userA: number, userB: number) => `${Math.min(userA, userB)}_${Math.max(userA, userB)}`;
+
 export default function Matches() {
     const router = useRouter();
     const { data: matches } = useSWR<MatchedUser[]>('/matches', fetcher);
@@ -39,35 +65,186 @@ export default function Matches() {
     const [newMessage, setNewMessage] = useState('');
     const messagesEndRef = useRef<HTMLDivElement>(null);
     const pollInterval = useRef<NodeJS.Timeout | null>(null);
+    const socketRef = useRef<WebSocket | null>(null);
+    const { data: currentUser } = useSWR<{ id: number }>('/auth/users/me', fetcher);
+    // Last message per conversation, for the previews in the matches list
+    const { data: conversations } = useSWR<{ results: ConversationSummary[] }>(CONVERSATIONS_KEY, fetcher);
+    const lastMessages = new Map(conversations?.results.map(summary => [summary.user.id, summary.last_message]));
     const [searchQuery, setSearchQuery] = useState('');
 
-    // Fetch messages for selected user
+    const lastMessageId = useRef<number | null>(null);
+    const [hasOlderMessages, setHasOlderMessages] = useState(false);
+
+    // Merge new messages into the conversation, skipping ones already shown.
+    // Polls resend recent messages, and one that committed late can belong
+    // before messages already shown, so the result is kept in id order
+    const appendMessages = (incoming: Message[]) => {
+        if (incoming.length === 0) return;
+        setMessages(prev => {
+            const seen = new Set(prev.map(message => message.id));
+            const added = incoming.filter(message => !seen.has(message.id));
+            if (added.length === 0) return prev;
+            return [...prev, ...added].sort((a, b) => a.id - b.id);
+        });
+        lastMessageId.current = Math.max(lastMessageId.current ?? 0, ...incoming.map(message => message.id));
+    };
+
+    // Fetch the latest page of messages for the selected user
     const fetchMessages = async () => {
         if (selectedUser) {
             try {
-                const data = await fetcher(`/chat-history/${selectedUser.user.id}`);
+                const data: Message[] = await fetcher(`/chat-history/${selectedUser.user.id}/?limit=${CHAT_PAGE_SIZE}`);
                 setMessages(data);
+                setHasOlderMessages(data.length === CHAT_PAGE_SIZE);
+                lastMessageId.current = data.length > 0 ? data[data.length - 1].id : null;
+            } catch (error) {
+                console.error('Error fetching messages:', error);
+            }
+        }
+    };
+
+    // Only ask for messages newer than the last one we have
+    const fetchNewMessages = async () => {
+        if (selectedUser) {
+            try {
+                const query = lastMessageId.current !== null ? `?after_id=${lastMessageId.current}` : '';
+                const data: Message[] = await fetcher(`/chat-history/${selectedUser.user.id}/${query}`);
+                appendMessages(data);
+            } catch (error) {
+                console.error('Error fetching messages:', error);
+            }
+        }
+    };
+
+    const fetchOlderMessages = async () => {
+        if (selectedUser && messages.length > 0) {
+            try {
+                const data: Message[] = await fetcher(
+                    `/chat-history/${selectedUser.user.id}/?before_id=${messages[0].id}&limit=${CHAT_PAGE_SIZE}`
+                );
+                setMessages(prev => [...data, ...prev]);
+                setHasOlderMessages(data.length === CHAT_PAGE_SIZE);
             } catch (error) {
                 console.error('Error fetching messages:', error);
             }
         }
     };
 
+    // The socket handlers outlive renders, so they read these refs
+    const selectedUserRef = useRef<MatchedUser | null>(null);
+    selectedUserRef.current = selectedUser;
+    const fetchNewMessagesRef = useRef(fetchNewMessages);
+    fetchNewMessagesRef.current = fetchNewMessages;
+    const [socketOpen, setSocketOpen] = useState(false);
+    const [typingUserId, setTypingUserId] = useState<number | null>(null);
+    const typingTimeout = useRef<NodeJS.Timeout | null>(null);
+    const lastTypingSent = useRef(0);
+
+    // One socket per user carries every conversation, read receipts and
+    // match events; chat frames name their conversation
     useEffect(() => {
+        if (!currentUser) return;
+
+        const socket = new WebSocket(`${WS_URL}/ws/chat/?token=${getToken('access')}`);
+        socket.onopen = () => {
+            setSocketOpen(true);
+            // Catch up on anything sent before the socket opened
+            fetchNewMessagesRef.current();
+        };
+        socket.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            const selected = selectedUserRef.current;
+            const isSelected = selected !== null
+                && data.conversation === conversationId(currentUser.id, selected.user.id);
+            if (data.type === 'match' || data.type === 'presence') {
+                // Requests, new matches, unmatches and matches coming online
+                // or going offline change the matches list
+                mutate('/matches');
+            } else if (data.type === 'typing') {
+                if (isSelected) {
+                    setTypingUserId(data.user_id);
+                    if (typingTimeout.current) clearTimeout(typingTimeout.current);
+                    typingTimeout.current = setTimeout(() => setTypingUserId(null), TYPING_SHOW_MS);
+                }
+            } else if (data.type === 'read') {
+                // The other side has read up to last_read_id
+                if (isSelected && data.reader_id !== currentUser.id) {
+                    setMessages(prev => prev.map(message =>
+                        message.sender_id === currentUser.id && message.id <= data.last_read_id
+                            ? { ...message, is_read: true }
+                            : message
+                    ));
+                }
+            } else if (data.type === 'message') {
+                mutate(CONVERSATIONS_KEY);
+                if (isSelected) {
+                    appendMessages([data]);
+                    if (data.sender_id !== currentUser.id) setTypingUserId(null);
+                    // The conversation is open, so report it as read right away
+                    if (data.sender_id !== currentUser.id) {
+                        socket.send(JSON.stringify({ type: 'read', conversation: data.conversation, last_read_id: data.id }));
+                    }
+                } else if (data.sender_id !== currentUser.id) {
+                    // Refresh the unread count of the other conversation
+                    mutate('/matches');
+                }
+            }
+        };
+        socket.onclose = () => {
+            if (socketRef.current === socket) {
+                socketRef.current = null;
+                setSocketOpen(false);
+            }
+        };
+        socketRef.current = socket;
+        const heartbeat = setInterval(() => {
+            if (socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify({ type: 'heartbeat' }));
+            }
+        }, HEARTBEAT_MS);
+
+        return () => {
+            clearInterval(heartbeat);
+            socketRef.current = null;
+            setSocketOpen(false);
+            socket.close();
+        };
+    }, [currentUser]);
+
+    useEffect(() => {
+        setTypingUserId(null);
         if (selectedUser) {
-            // Initial fetch
+            lastMessageId.current = null;
             fetchMessages();
+        }
+    }, [selectedUser]);
 
-            // Set up polling
-            pollInterval.current = setInterval(fetchMessages, 3000); // Poll every 3 seconds
+    // Tell the other side we're typing, at most once per TYPING_SEND_MS
+    const notifyTyping = () => {
+        const socket = socketRef.current;
+        const now = Date.now();
+        if (socket && socket.readyState === WebSocket.OPEN && currentUser && selectedUser
+            && now - lastTypingSent.current >= TYPING_SEND_MS) {
+            lastTypingSent.current = now;
+            socket.send(JSON.stringify({
+                type: 'typing',
+                conversation: conversationId(currentUser.id, selectedUser.user.id),
+            }));
+        }
+    };
 
+    // Polling for new messages is only the fallback while the socket is down
+    useEffect(() => {
+        if (selectedUser && !socketOpen) {
+            pollInterval.current = setInterval(fetchNewMessages, 3000); // Poll every 3 seconds
             return () => {
                 if (pollInterval.current) {
                     clearInterval(pollInterval.current);
+                    pollInterval.current = null;
                 }
             };
         }
-    }, [selectedUser]);
+    }, [selectedUser, socketOpen]);
 
     useEffect(() => {
         messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -76,6 +253,17 @@ export default function Matches() {
     const sendMessage = async (e: React.FormEvent) => {
         e.preventDefault();
         if (newMessage.trim() && selectedUser) {
+            const socket = socketRef.current;
+            if (socket && socket.readyState === WebSocket.OPEN && currentUser) {
+                // The server echoes the saved message back through the socket
+                socket.send(JSON.stringify({
+                    message: newMessage,
+                    sender_id: currentUser.id,
+                    receiver_id: selectedUser.user.id,
+                }));
+                setNewMessage('');
+                return;
+            }
             try {
                 const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/messages/${selectedUser.user.id}/`, {
                     method: 'POST',
@@ -93,7 +281,7 @@ export default function Matches() {
                 }
 
                 const newMessageData = await response.json();
-                setMessages(prev => [...prev, newMessageData]);
+                appendMessages([newMessageData]);
                 setNewMessage('');
             } catch (error) {
                 console.error('Error sending message:', error);
@@ -166,10 +354,32 @@ export default function Matches() {
                                 ) : (
                                     <div className="w-12 h-12 rounded-full bg-gray-200 mr-4" />
                                 )}
-                                <div>
-                                    <h2 className="font-semibold">{match.user.username}</h2>
-                                    <p className="text-sm text-gray-600">{match.school}</p>
+                                <div className="flex-1">
+                                    <h2 className="font-semibold flex items-center gap-2">
+                                        {match.user.username}
+                                        {match.online && (
+                                            <span className="w-2 h-2 rounded-full bg-green-500" title="Online" />
+                                        )}
+                                    </h2>
+                                    {lastMessages.has(match.user.id) ? (
+                                        <p className="text-sm text-gray-600 truncate">
+                                            {lastMessages.get(match.user.id)!.content}
+                                            <span className="text-xs text-gray-400 ml-2">
+                                                {new Date(lastMessages.get(match.user.id)!.timestamp).toLocaleTimeString([], {
+                                                    hour: '2-digit',
+                                                    minute: '2-digit'
+                                                })}
+                                            </span>
+                                        </p>
+                                    ) : (
+                                        <p className="text-sm text-gray-600">{match.school}</p>
+                                    )}
                                 </div>
+                                {match.unread_count > 0 && selectedUser?.user.id !== match.user.id && (
+                                    <span className="bg-red-500 text-white rounded-full w-6 h-6 flex items-center justify-center text-xs">
+                                        {match.unread_count}
+                                    </span>
+                                )}
                             </div>
                         </div>
                     ))}
@@ -192,13 +402,30 @@ export default function Matches() {
                                 ) : (
                                     <div className="w-10 h-10 rounded-full bg-gray-200 mr-3" />
                                 )}
-                                <h2 className="text-xl font-semibold">{selectedUser.user.username}</h2>
+                                <div>
+                                    <h2 className="text-xl font-semibold">{selectedUser.user.username}</h2>
+                                    {typingUserId === selectedUser.user.id ? (
+                                        <p className="text-xs text-gray-500">typing...</p>
+                                    ) : matches.find(match => match.user.id === selectedUser.user.id)?.online && (
+                                        <p className="text-xs text-green-600">Online</p>
+                                    )}
+                                </div>
                             </div>
                         </div>
                         {/* Scrollable messages */}
                         <div className="flex-1 overflow-y-auto p-4 space-y-4 bg-gray-50">
+                            {hasOlderMessages && (
+                                <div className="flex justify-center">
+                                    <button
+                                        onClick={fetchOlderMessages}
+                                        className="text-sm text-blue-500 hover:underline"
+                                    >
+                                        Load earlier messages
+                                    </button>
+                                </div>
+                            )}
                             {messages.map((message) => {
-                                const isCurrentUser = message.sender_id === parseInt(getToken('user_id') || '0');
+                                const isCurrentUser = message.sender_id === currentUser?.id;
                                 return (
                                     <div
                                         key={message.id}
@@ -236,7 +463,10 @@ export default function Matches() {
                             <div className="flex gap-2">
                                 <textarea
                                     value={newMessage}
-                                    onChange={(e) => setNewMessage(e.target.value)}
+                                    onChange={(e) => {
+                                        setNewMessage(e.target.value);
+                                        notifyTyping();
+                                    }}
                                     onKeyDown={handleKeyDown}
                                     className="flex-1 border rounded-lg px-4 py-2 resize-none min-h-[44px] max-h-32 overflow-y-auto"
                                     placeholder="Type a message... (Shift + Enter for new line)"